@@ -1,5 +1,6 @@
 # Import necessary modules
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
 import os
@@ -7,20 +8,27 @@ import ssl
 import requests
 import upstox_client
 import websockets
-from google.protobuf.json_format import MessageToDict
 from dotenv import load_dotenv
 
 from agents import clear_conversation_history, get_conversation_history, master_agent
 from fetch_stock_price_data_utils import get_stock_price
 from fingreat import fetch_financials, generate_factors, generate_timeseries_nlp_representations_for_examples, get_knowledge_graph_summary, get_nifty50_companies_from_news_stocks, get_nlp_representation_last_n_working_days, get_other_day_stock, search_similar_news, to_json
-from llm_calls import query_gemini
-from similarity_search import load_resources
+from llm_calls import key_manager, query_gemini
+from llm_cache import LLM_CACHE_ENABLED, get_response_cache
+from similarity_search import load_index, load_metadata, load_model, refresh_segments, search_cache_stats
+from price_store import get_price_store
+from knowledge_graph import get_knowledge_graph
+from warmup import Warmup
+from stage_graph import Stage, run_stage_graph
 from templates import FEW_SHOT_PROMPT_EXAMPLES_TEMPLATE, FEW_SHOT_PROMPT_TEMPLATE
 load_dotenv()
-from upstox_client.feeder.proto import MarketDataFeed_pb2 as pb
 from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-from fetch_latest_price_for_csv import fetch_price_for_company
+from werkzeug.http import quote_etag
+from price_range_cache import get_price_range
+from market_feed import MARKET_FEED_RECORD, MarketPriceStore, decode_protobuf, write_frame
+from price_stream import KEEPALIVE_SECONDS, PriceStreamHub, format_event
+from tick_store import BAR_INTERVALS, TickStore
 
 from templates import (
     FEW_SHOT_PROMPT_TEMPLATE,
@@ -30,18 +38,30 @@ from templates import (
     REFINE_DECISION_PROMPT_TEMPLATE_1,
     REFINE_DECISION_PROMPT_TEMPLATE_2,
     KG_NODES_MAPPING,
-    INSTRUMENT_KEYS,
-    INVERSE_INSTRUMENT_KEYS
+    INSTRUMENT_KEYS
 )
 
 
-load_resources()
+# Heavy resources load in the background so the server can start accepting requests right away.
+# Routes that need them (/process_news) wait for them on first use, the others never do.
+warmup = Warmup()
+warmup.register("price_store", get_price_store)
+warmup.register("knowledge_graph", get_knowledge_graph)
+warmup.register("faiss_index", load_index)
+warmup.register("news_metadata", load_metadata)
+warmup.register("embedding_model", load_model)
+warmup.register("news_segments", refresh_segments)
+warmup.start()
+
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # This enables CORS for all routes
 
-# Global variable to store market data
-market_data = {}
+# Latest price of every instrument, written by the feed loop and pushed to /market_stream clients,
+# plus a bounded tick history per instrument for /market_bars
+tick_store = TickStore(len(INSTRUMENT_KEYS))
+market_prices = MarketPriceStore(INSTRUMENT_KEYS, tick_store)
+price_hub = PriceStreamHub(market_prices).start()
 
 # Initialize access_tokens dictionary before defining routes
 access_tokens = {}
@@ -53,16 +73,10 @@ def get_market_data_feed_authorize(api_version, configuration):
     api_response = api_instance.get_market_data_feed_authorize(api_version)
     return api_response
 
-def decode_protobuf(buffer):
-    """Decode protobuf message."""
-    feed_response = pb.FeedResponse()
-    feed_response.ParseFromString(buffer)
-    return feed_response
-
 async def fetch_market_data_loop():
     """Background task to continuously fetch market data."""
-    global market_data
-    
+    record_file = open(MARKET_FEED_RECORD, "ab") if MARKET_FEED_RECORD else None
+
     # Create default SSL context
     ssl_context = ssl.create_default_context()
     ssl_context.check_hostname = False
@@ -103,34 +117,10 @@ async def fetch_market_data_loop():
                 # Continuously receive and decode data from WebSocket
                 while True:
                     message = await websocket.recv()
-                    decoded_data = decode_protobuf(message)
-
-                    # Convert the decoded data to a dictionary
-                    data_dict = MessageToDict(decoded_data)
-                    
-                    # Process market data
-                    if "feeds" in data_dict:
-                        for instrument_key, feed_data in data_dict["feeds"].items():
-                            if "ltpc" in feed_data:
-                                # Get symbol from inverse mapping
-                                symbol = INVERSE_INSTRUMENT_KEYS.get(instrument_key, instrument_key)
-                                
-                                # Extract price data
-                                ltpc_data = feed_data["ltpc"]
-                                ltp = float(ltpc_data.get("ltp", 0))
-                                cp = float(ltpc_data.get("cp", 0))
-                                
-                                # Calculate percent change
-                                percent_change = 0
-                                if cp > 0:
-                                    percent_change = round(((ltp - cp) * 100 / cp), 2)
-                                
-                                # Store in global market data
-                                market_data[symbol] = {
-                                    "price": ltp,
-                                    "change": round(ltp-cp, 2),
-                                    "percentage_change": percent_change
-                                }
+                    if record_file:
+                        write_frame(record_file, message)
+                    # Ticks go straight from the protobuf into the price arrays, no dicts in between
+                    market_prices.apply(decode_protobuf(message))
         
         except Exception as e:
             print(f"Error in WebSocket connection: {e}")
@@ -140,18 +130,67 @@ async def fetch_market_data_loop():
 # Flask routes
 @app.route('/market_prices', methods=['GET'])
 def get_market_prices():
-    """Endpoint to get all market prices."""
-    return jsonify(market_data)
+    """
+    Endpoint to get all market prices. Served from the current snapshot's pre-encoded body, and
+    answered with 304 when the client already has this version (If-None-Match).
+    """
+    snapshot = market_prices.snapshot
+    # The gzip and identity bodies are different representations, so each gets its own ETag
+    use_gzip = request.accept_encodings["gzip"] > 0
+    etag = f"{snapshot.etag}-gzip" if use_gzip else snapshot.etag
+    headers = {"ETag": quote_etag(etag), "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    # If-None-Match uses the weak comparison (RFC 9110), which also matches W/"..." and *
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    if use_gzip:
+        return Response(snapshot.gzip_bytes, mimetype="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(snapshot.json_bytes, mimetype="application/json", headers=headers)
+
+@app.route('/market_stream', methods=['GET'])
+def stream_market_prices():
+    """
+    Server-Sent Events stream of price changes. The first event has every quote, later ones only
+    the fields that changed. `?symbols=TCS,INFY` limits the stream to those symbols.
+    """
+    symbols = [symbol for symbol in request.args.get("symbols", "").split(",") if symbol]
+    subscription = price_hub.subscribe(symbols)
+
+    def events():
+        try:
+            while True:
+                event = subscription.next_event(timeout=KEEPALIVE_SECONDS)
+                yield ": keepalive\n\n" if event is None else format_event(*event)
+        finally:
+            price_hub.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.route('/market_price/<symbol>', methods=['GET'])
 def get_symbol_price(symbol):
     """Endpoint to get price for a specific symbol."""
     symbol = symbol.upper()
-    if symbol in market_data:
-        return jsonify(market_data[symbol])
+    quote = market_prices.get(symbol)
+    if quote is not None:
+        return jsonify(quote)
     else:
         return jsonify({"error": "Symbol not found"}), 404
 
+@app.route('/market_bars/<symbol>', methods=['GET'])
+def get_intraday_bars(symbol):
+    """Intraday OHLC bars built from the live feed, `?interval=1m|5m|15m` (default 1m), newest first."""
+    symbol = symbol.upper()
+    interval = request.args.get('interval', '1m')
+    if interval not in BAR_INTERVALS:
+        return jsonify({"error": f"interval must be one of {list(BAR_INTERVALS)}"}), 400
+    slot = market_prices.symbol_slots.get(symbol)
+    if slot is None:
+        return jsonify({"error": "Symbol not found"}), 404
+    return jsonify(tick_store.bars(slot, interval))
+
 # Background task starter
 def start_background_task():
     """Start the background market data fetching."""
@@ -168,118 +207,67 @@ def process_news():
     date_of_publish = data['date_of_publish']
     index = data.get('index', 0)
 
-    def generate():
-        # Initial message
-        status = {
-            "stage": 0,
-            "message": "Analysing your financial news",
-            "total_stages": 9
-        }
-        yield json.dumps(status) + "\n"
-        
-        # Step 1: Fetching similar articles
-        status = {
-            "stage": 1,
-            "message": "Looking at similar events in the past",
-            "total_stages": 9
-        }
-        yield json.dumps(status) + "\n"
-        
-        similar_articles = search_similar_news(news_article)
-        
-        status["message"] = f"Retrieved {len(similar_articles)} similar articles for comparative study"
-        yield json.dumps(status) + "\n"
-
+    # Step 1: Fetching similar articles
+    def find_similar_articles():
+        similar_articles = search_similar_news(news_article, date_of_publish)
         similar_articles = sorted(similar_articles, key=lambda x: x["score"], reverse=True)[:3]
-        filtered_articles = [
+        return [
             (article["article_title"], article["article_description"], article["article_stocks"], article["article_date"])
             for article in similar_articles
         ]
 
-        # Step 2: Generating examples
-        status = {
-            "stage": 2,
-            "message": "Analysing how market reacted to similar past events",
-            "total_stages": 9
-        }
-        yield json.dumps(status) + "\n"
-        
-        few_shot_prompt_examples = ""
-        for article in filtered_articles:
+    # Step 2: Generating examples
+    def build_examples(filtered_articles):
+        def build_example(article, company):
             date = article[3]
-            nifty_50_companies = get_nifty50_companies_from_news_stocks(article[2])
-            for company in nifty_50_companies:
-                stock_price_last_working_day = get_other_day_stock(company, date, True)
-                stock_price_that_day = get_stock_price(company, date)
-                stock_price_next_working_day = get_other_day_stock(company, date, False)
+            stock_price_last_working_day = get_other_day_stock(company, date, True)
+            stock_price_that_day = get_stock_price(company, date)
+            stock_price_next_working_day = get_other_day_stock(company, date, False)
 
-                stock_movement_info = generate_timeseries_nlp_representations_for_examples(
-                    stock_price_last_working_day, stock_price_that_day, stock_price_next_working_day
-                )
+            stock_movement_info = generate_timeseries_nlp_representations_for_examples(
+                stock_price_last_working_day, stock_price_that_day, stock_price_next_working_day
+            )
 
-                factors = generate_factors(article[0] + ". " + article[1], company)
-                factor_str = " | ".join(factors)
+            factors = generate_factors(article[0] + ". " + article[1], company)
+            factor_str = " | ".join(factors)
 
-                few_shot_prompt_examples += FEW_SHOT_PROMPT_EXAMPLES_TEMPLATE.format(company, factor_str, stock_movement_info)
-        
-        status["message"] = "Huh, that took a while, but I've analysed past events"
-        yield json.dumps(status) + "\n"
-        
+            return FEW_SHOT_PROMPT_EXAMPLES_TEMPLATE.format(company, factor_str, stock_movement_info)
 
-        # Step 3: Creating the prompt
-        status = {
-            "stage": 3,
-            "message": "Thinking on how your news will impact the market",
-            "total_stages": 9
-        }
-        yield json.dumps(status) + "\n"
-        
-        few_shot_prompt = FEW_SHOT_PROMPT_TEMPLATE.format(KG_NODES_MAPPING[company_ticker], few_shot_prompt_examples)
+        work_items = [
+            (article, company)
+            for article in filtered_articles
+            for company in get_nifty50_companies_from_news_stocks(article[2])
+        ]
+        # Every (article, company) pair is independent, so run them side by side on as many threads
+        # as there are Gemini keys, then join the examples in the original order to keep the prompt stable
+        if not work_items:
+            return ""
+        with ThreadPoolExecutor(max_workers=min(len(work_items), max(1, len(key_manager.keys)))) as executor:
+            return "".join(executor.map(lambda item: build_example(*item), work_items))
+
+    # Step 3: Factors of the news itself
+    def find_news_factors():
         news_factors = generate_factors(news_article, KG_NODES_MAPPING[company_ticker])
-        news_factors = "| ".join(news_factors)
+        return "| ".join(news_factors)
+
+    # Step 4: Initial market impact analysis
+    def analyse_initial_impact(few_shot_prompt_examples, news_factors):
+        few_shot_prompt = FEW_SHOT_PROMPT_TEMPLATE.format(KG_NODES_MAPPING[company_ticker], few_shot_prompt_examples)
         few_shot_prompt += FEW_SHOT_PROMPT_TEMPLATE_END.format(news_factors)
+        return to_json(query_gemini(few_shot_prompt))
 
-        # Step 4: Initial market impact analysis
-        status = {
-            "stage": 4,
-            "message": "Ahh, things makes sense to me now",
-            "total_stages": 9
-        }
-        few_shot_prompt_response = to_json(query_gemini(few_shot_prompt))
-        
-        yield json.dumps(status) + "\n"
-        
-        
-        # Step 5: Knowledge graph analysis
-        status = {
-            "stage": 5,
-            "message": "Let me gather some background knowledge about the company",
-            "total_stages": 9
-        }
-        
-        yield json.dumps(status) + "\n"
-        knowledge_graph_summary = get_knowledge_graph_summary(news_article, company_ticker)
+    # Step 5: Knowledge graph analysis
+    def summarise_knowledge_graph():
+        return get_knowledge_graph_summary(news_article, company_ticker)
 
-        # Step 6: Financial analysis
-        status = {
-            "stage": 6,
-            "message": "Let me now look at some financial metrics of the company",
-            "total_stages": 9
-        }
-        
-        yield json.dumps(status) + "\n"
+    # Step 6: Financial analysis
+    def analyse_financials():
         financials = fetch_financials(company_ticker)
         company_financials_prompt = COMPANY_FINANCIALS_PROMPT_TEMPLATE.format(financials)
-        financial_analysis_response = to_json(query_gemini(company_financials_prompt))
+        return to_json(query_gemini(company_financials_prompt, cache_site="company_financials"))
 
-        # Step 7: First refinement
-        status = {
-            "stage": 7,
-            "message": "That's a lot of data, let's see how can we put it all together",
-            "total_stages": 9
-        }
-        yield json.dumps(status) + "\n"
-        
+    # Step 7: First refinement
+    def refine_with_background(news_factors, few_shot_prompt_response, knowledge_graph_summary, financial_analysis_response):
         refine_decision_prompt_1 = REFINE_DECISION_PROMPT_TEMPLATE_1.format(
             news_factors,
             few_shot_prompt_response["result"],
@@ -287,35 +275,72 @@ def process_news():
             knowledge_graph_summary,
             financial_analysis_response
         )
-        refine_decision_prompt_response_1 = to_json(query_gemini(refine_decision_prompt_1))
+        return to_json(query_gemini(refine_decision_prompt_1))
 
-        # Step 8: Time series
-        status = {
-            "stage": 8,
-            "message": "Let's analyse how your stock is performing over the last week",
-            "total_stages": 9
-        }
-        yield json.dumps(status) + "\n"
-        
-        company_stock_timeseries_representation = get_nlp_representation_last_n_working_days(company_ticker, date_of_publish)
+    # Step 8: Time series
+    def summarise_time_series():
+        return get_nlp_representation_last_n_working_days(company_ticker, date_of_publish)
 
-        # Step 9: Final refinement
-        status = {
-            "stage": 9,
-            "message": "Great! Generating my final verdict...",
-            "total_stages": 9
-        }
-        yield json.dumps(status) + "\n"
-        
+    # Step 9: Final refinement
+    def refine_with_time_series(news_factors, refine_decision_prompt_response_1, company_stock_timeseries_representation):
         refine_decision_prompt_2 = REFINE_DECISION_PROMPT_TEMPLATE_2.format(
             news_factors,
             refine_decision_prompt_response_1["result"],
             refine_decision_prompt_response_1["explanation"],
             company_stock_timeseries_representation
         )
-        refine_decision_prompt_response_2 = to_json(query_gemini(refine_decision_prompt_2))
+        return to_json(query_gemini(refine_decision_prompt_2))
+
+    # The knowledge graph, financials and time series stages only need the request itself, so they
+    # run alongside the similar-news search and example generation instead of after them
+    stages = [
+        Stage("similar_articles", find_similar_articles,
+              message=lambda articles: f"Retrieved {len(articles)} similar articles for comparative study"),
+        Stage("examples", build_examples, ["similar_articles"],
+              message="Huh, that took a while, but I've analysed past events"),
+        Stage("news_factors", find_news_factors,
+              message="Thinking on how your news will impact the market"),
+        Stage("initial_analysis", analyse_initial_impact, ["examples", "news_factors"],
+              message="Ahh, things makes sense to me now"),
+        Stage("knowledge_graph", summarise_knowledge_graph,
+              message="Gathered some background knowledge about the company"),
+        Stage("financials", analyse_financials,
+              message="Looked at some financial metrics of the company"),
+        Stage("refine_1", refine_with_background, ["news_factors", "initial_analysis", "knowledge_graph", "financials"],
+              message="That's a lot of data, let's see how can we put it all together"),
+        Stage("time_series", summarise_time_series,
+              message="Analysed how your stock is performing over the last week"),
+        Stage("refine_2", refine_with_time_series, ["news_factors", "refine_1", "time_series"],
+              message="Great! Generating my final verdict..."),
+    ]
+
+    # Each stage keeps the number it had in the sequential pipeline (1-9), whatever order it finishes in
+    stage_ids = {stage.name: i for i, stage in enumerate(stages, start=1)}
 
-        yield json.dumps(refine_decision_prompt_response_2) + "\n"
+    def generate():
+        # Initial message
+        status = {
+            "stage": 0,
+            "completed_stages": 0,
+            "message": "Analysing your financial news",
+            "total_stages": len(stages)
+        }
+        yield json.dumps(status) + "\n"
+
+        # Stages finish out of order, so progress is reported separately from which stage finished
+        completed = 0
+        for stage, result in run_stage_graph(stages):
+            completed += 1
+            if stage.name == "refine_2":
+                yield json.dumps(result) + "\n"
+                break
+            status = {
+                "stage": stage_ids[stage.name],
+                "completed_stages": completed,
+                "message": stage.completion_message(result),
+                "total_stages": len(stages)
+            }
+            yield json.dumps(status) + "\n"
 
     return Response(stream_with_context(generate()), mimetype='application/json')
 
@@ -326,7 +351,9 @@ def get_time_series_price():
     company = request.args.get('company')
     from_date = request.args.get('from_date')
     to_date = request.args.get('to_date')
-    return fetch_price_for_company(company, from_date, to_date)
+    if not company or not from_date or not to_date:
+        return jsonify({"error": "company, from_date and to_date are required"}), 400
+    return get_price_range(company, from_date, to_date)
 
 @app.route('/<user_id>/<company_ticker>/agents/<agent_name>/conversations', methods=['GET'])
 def get_conversations(user_id, company_ticker, agent_name):
@@ -423,6 +450,27 @@ def logout():
 def index():
     return "Welcome to FinGReaT!"
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Liveness: the process is serving requests. Also reports how far the warm-up has got, the
+    budget left on every Gemini key (identified by position, never by the key itself), and the
+    hits and misses of the LLM response cache and the similarity search cache.
+    """
+    return jsonify({
+        "status": "ok",
+        "resources": warmup.status(),
+        "gemini_keys": key_manager.stats(),
+        "llm_cache": get_response_cache().stats() if LLM_CACHE_ENABLED else {"enabled": False},
+        "search_cache": search_cache_stats(),
+    }), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: every heavy resource has loaded, so /process_news will not wait on them."""
+    ready = warmup.is_ready()
+    return jsonify({"ready": ready, "resources": warmup.status()}), 200 if ready else 503
+
 if __name__ == '__main__':
     # Start the market data fetcher in a background thread
     import threading
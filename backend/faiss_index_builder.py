@@ -0,0 +1,176 @@
+import argparse
+import math
+import time
+import faiss
+import numpy as np
+
+# Builds approximate variants of faiss_index.bin from the same embeddings and measures them
+# against exact search, so an operating point can be picked before the corpus grows:
+#
+#   python faiss_index_builder.py build ivf_flat faiss_index_ivf.bin
+#   python faiss_index_builder.py benchmark --synthetic 1000000
+#
+# similarity_search picks the file up through FAISS_INDEX_FILE and applies FAISS_NPROBE /
+# FAISS_EF_SEARCH at query time.
+
+INDEX_FILE = "faiss_index.bin"
+INDEX_KINDS = ["flat", "ivf_flat", "hnsw", "ivf_pq"]
+
+
+def load_embeddings(index_file=INDEX_FILE):
+    """Reads the stored vectors back out of an exact (flat) index."""
+    index = faiss.read_index(index_file)
+    return index.reconstruct_n(0, index.ntotal), index.metric_type
+
+
+def default_nlist(n):
+    # ~4 * sqrt(n) lists, with at least 39 training points per list as FAISS recommends
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def build_index(embeddings, kind, metric=faiss.METRIC_L2, nlist=None, hnsw_m=32, ef_construction=200, pq_m=None, pq_bits=8):
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n, d = embeddings.shape
+    if kind == "flat":
+        index = faiss.IndexFlat(d, metric)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m, metric)
+        index.hnsw.efConstruction = ef_construction
+    elif kind in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlat(d, metric)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, metric)
+        else:
+            # PQ needs d to be a multiple of the number of sub-quantizers
+            pq_m = pq_m or next(m for m in (48, 32, 24, 16, 12, 8, 4, 2, 1) if d % m == 0)
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_bits, metric)
+        index.train(embeddings)
+    else:
+        raise ValueError(f"Unknown index kind {kind}, expected one of {INDEX_KINDS}")
+    index.add(embeddings)
+    return index
+
+
+def add_with_ids(index, vectors, ids):
+    """
+    Appends vectors under explicit ids. IVF indexes store the ids; flat and HNSW indexes number
+    vectors in insertion order, so there the ids have to continue from ntotal.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    if faiss.try_extract_index_ivf(index) is not None:
+        index.add_with_ids(vectors, ids)
+    elif len(ids) and (ids[0] != index.ntotal or np.any(np.diff(ids) != 1)):
+        raise ValueError(f"{type(index).__name__} can only append ids {index.ntotal}, {index.ntotal + 1}, ...")
+    else:
+        index.add(vectors)
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Applies query-time knobs; the ones the index does not have are ignored."""
+    params = faiss.ParameterSpace()
+    if nprobe is not None and hasattr(faiss.try_extract_index_ivf(index), "nprobe"):
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search is not None and hasattr(index, "hnsw"):
+        params.set_index_parameter(index, "efSearch", ef_search)
+
+
+def search_parameters(index, selector):
+    """SearchParameters that restrict a search to `selector`, keeping the index's nprobe / efSearch."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def index_memory_mb(index):
+    return len(faiss.serialize_index(index)) / 1e6
+
+
+def evaluate(index, queries, exact_ids, k):
+    """Returns recall@k against exact_ids, p50/p99 single-query latency in ms."""
+    latencies = []
+    hits = 0
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(ids[0]) & set(exact_ids[i]))
+    return hits / (len(queries) * k), float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+def synthetic_embeddings(n, d=384, clusters=1000, seed=0):
+    """Clustered unit vectors shaped like MiniLM sentence embeddings, for sizing beyond the real corpus."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, d)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 1.5 * rng.standard_normal((n, d)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def benchmark(embeddings, metric=faiss.METRIC_L2, k=9, n_queries=500, seed=0):
+    rng = np.random.default_rng(seed)
+    # Perturbed corpus vectors stand in for new articles close to existing ones
+    queries = embeddings[rng.choice(len(embeddings), min(n_queries, len(embeddings)), replace=False)]
+    queries = np.ascontiguousarray(queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32))
+
+    exact = build_index(embeddings, "flat", metric)
+    _, exact_ids = exact.search(queries, k)
+    recall, p50, p99 = evaluate(exact, queries, exact_ids, k)
+    print(f"{'index':<10} {'setting':<14} {'recall@' + str(k):>9} {'p50 ms':>8} {'p99 ms':>8} {'MB':>8} {'build s':>8}")
+    print(f"{'flat':<10} {'exact':<14} {recall:>9.3f} {p50:>8.3f} {p99:>8.3f} {index_memory_mb(exact):>8.1f} {'-':>8}")
+
+    sweeps = {
+        "ivf_flat": ("nprobe", [1, 4, 16, 64]),
+        "ivf_pq": ("nprobe", [1, 4, 16, 64]),
+        "hnsw": ("efSearch", [16, 32, 64, 128]),
+    }
+    for kind, (knob, values) in sweeps.items():
+        start = time.perf_counter()
+        index = build_index(embeddings, kind, metric)
+        build_seconds = time.perf_counter() - start
+        memory = index_memory_mb(index)
+        for value in values:
+            if knob == "nprobe":
+                set_search_params(index, nprobe=value)
+            else:
+                set_search_params(index, ef_search=value)
+            recall, p50, p99 = evaluate(index, queries, exact_ids, k)
+            print(f"{kind:<10} {knob + '=' + str(value):<14} {recall:>9.3f} {p50:>8.3f} {p99:>8.3f} {memory:>8.1f} {build_seconds:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and benchmark approximate FAISS indexes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="build an index from the embeddings in --source")
+    build_parser.add_argument("kind", choices=INDEX_KINDS)
+    build_parser.add_argument("output")
+    build_parser.add_argument("--source", default=INDEX_FILE)
+    build_parser.add_argument("--nlist", type=int)
+    build_parser.add_argument("--hnsw-m", type=int, default=32)
+    build_parser.add_argument("--ef-construction", type=int, default=200)
+    build_parser.add_argument("--pq-m", type=int)
+    build_parser.add_argument("--pq-bits", type=int, default=8)
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="recall@k, latency and memory of every index kind")
+    benchmark_parser.add_argument("--source", default=INDEX_FILE)
+    benchmark_parser.add_argument("--synthetic", type=int, help="benchmark on N synthetic vectors instead of --source")
+    benchmark_parser.add_argument("--k", type=int, default=9)
+    benchmark_parser.add_argument("--queries", type=int, default=500)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        embeddings, metric = load_embeddings(args.source)
+        index = build_index(embeddings, args.kind, metric, args.nlist, args.hnsw_m, args.ef_construction, args.pq_m, args.pq_bits)
+        faiss.write_index(index, args.output)
+        print(f"✅ Wrote {args.kind} index with {index.ntotal} vectors to {args.output} ({index_memory_mb(index):.1f} MB)")
+    else:
+        if args.synthetic:
+            embeddings, metric = synthetic_embeddings(args.synthetic), faiss.METRIC_L2
+        else:
+            embeddings, metric = load_embeddings(args.source)
+        benchmark(embeddings, metric, args.k, args.queries)
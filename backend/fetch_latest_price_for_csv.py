@@ -1,8 +1,16 @@
+import argparse
 import json
+import tempfile
+import threading
+import time
 import urllib3
 import os
+import sys
 import csv
 import io
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -18,17 +26,67 @@ to_date_3 = "2025-04-28"
 
 from templates import INSTRUMENT_KEYS
 
-# Initialize urllib3 pool manager
-http = urllib3.PoolManager()
+# Point this at a local stand-in (see historical_candle_stub.py) to run the refresh offline
+BASE_URL = os.getenv("UPSTOX_BASE_URL", "https://api.upstox.com")
+DATA_FOLDER = "stock_price"
+CSV_FIELDS = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+# Upstox allows 50 requests per second on the standard APIs, stay a little under it by default
+DEFAULT_REQUESTS_PER_SECOND = 25
+DEFAULT_WORKERS = 8
+MAX_WORKERS = 32
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Initialize urllib3 pool manager, shared by every download thread (one kept-alive connection per worker)
+http = urllib3.PoolManager(maxsize=MAX_WORKERS)
+
+class PriceFetchError(Exception):
+    """Raised by fetch_price_for_company(raise_errors=True) when the candles could not be fetched."""
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls to `acquire` at least 1 / requests_per_second apart."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def retry_after_seconds(value, default):
+    """Seconds to wait for a Retry-After header, either delay-seconds or an HTTP date; `default` if it can't be read."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        return default
+    return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
 
 # Hardcoded access token (replace with a valid one if expired)
 def get_access_token():
     return os.getenv("UPSTOX_ACCESS_TOKEN")
 
-def fetch_price_for_company(company, from_date, to_date):
+def fetch_price_for_company(company, from_date, to_date, base_url=None, rate_limiter=None, max_retries=0, backoff=0.5, raise_errors=False):
+    """
+    Daily candles of `company` between two dates, newest first. A failed request returns [] like
+    a range without candles, unless raise_errors is set, then it raises PriceFetchError instead.
+    """
     print(f"Fetching data for {company} from {from_date} to {to_date}")
     access_token = get_access_token()
-    base_url = "https://api.upstox.com/v2/historical-candle"
+    base_url = f"{base_url or BASE_URL}/v2/historical-candle"
     interval = "day"
     url = f"{base_url}/{INSTRUMENT_KEYS[company]}/{interval}/{to_date}/{from_date}"
     headers = {
@@ -36,30 +94,125 @@ def fetch_price_for_company(company, from_date, to_date):
         "Authorization": f"Bearer {access_token}"
     }
 
-    response = http.request('GET', url, headers=headers)
-    if response.status == 200:
-        candles = json.loads(response.data.decode('utf-8'))['data']['candles']
-        formatted_data = [
-            [row[0].split("T")[0]] + row[1:] for row in candles
-        ]
-        return formatted_data
-    else:
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            # Retries are ours (rate limited, with backoff), not urllib3's, which would also choke on odd Retry-After values
+            response = http.request('GET', url, headers=headers, retries=False)
+        except urllib3.exceptions.HTTPError as e:
+            if attempt < max_retries:
+                time.sleep(backoff * 2 ** attempt)
+                continue
+            print(f"Error fetching data for {company}: {e}")
+            if raise_errors:
+                raise PriceFetchError(f"{company}: {e}") from e
+            return []
+
+        if response.status == 200:
+            candles = json.loads(response.data.decode('utf-8'))['data']['candles']
+            formatted_data = [
+                [row[0].split("T")[0]] + row[1:] for row in candles
+            ]
+            return formatted_data
+        if response.status in RETRY_STATUSES and attempt < max_retries:
+            # Honour Retry-After on 429s, otherwise back off exponentially
+            time.sleep(retry_after_seconds(response.headers.get("Retry-After"), backoff * 2 ** attempt))
+            continue
+
         error_details = json.loads(response.data.decode('utf-8')) if response.data else {}
         print(f"Error fetching data for {company}: {response.status}, Details: {error_details}")
+        if raise_errors:
+            raise PriceFetchError(f"{company}: HTTP {response.status}")
         return []
 
-def generate_csv_locally(data, company):
-    folder = 'stock_price'
+def generate_csv_locally(data, company, folder=DATA_FOLDER):
     os.makedirs(folder, exist_ok=True)
     filepath = os.path.join(folder, f"{company}.csv")
 
-    fields = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
     with open(filepath, 'w', newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(fields)
+        writer.writerow(CSV_FIELDS)
         for row in data:
             writer.writerow(row[:-1])  # Skip the last value (oi)
 
+def read_csv_rows(company, folder=DATA_FOLDER):
+    """Returns the stored rows of a company's CSV (without the header), or [] if there is no CSV yet."""
+    filepath = os.path.join(folder, f"{company}.csv")
+    if not os.path.exists(filepath):
+        return []
+    with open(filepath, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [row for row in reader if row]
+
+def merge_rows(new_rows, old_rows):
+    """Merges two lists of CSV rows into one, newest date first, keeping the new row when a date appears in both."""
+    merged = {}
+    for row in old_rows:
+        merged.setdefault(row[0], row)
+    for row in new_rows:
+        merged[row[0]] = row
+    return [merged[date] for date in sorted(merged, reverse=True)]
+
+def write_csv_atomically(rows, company, folder=DATA_FOLDER):
+    """Writes the CSV to a temporary file and renames it over the old one, so readers never see a partial file."""
+    os.makedirs(folder, exist_ok=True)
+    filepath = os.path.join(folder, f"{company}.csv")
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filepath, filepath)
+
+def refresh_company(company, to_date=None, folder=DATA_FOLDER, base_url=None):
+    """
+    Fetches only the candles after the newest date already stored for `company` and merges them
+    into its CSV. Returns the number of new rows, raises PriceFetchError if the download failed.
+    """
+    to_date = to_date or datetime.now().strftime("%Y-%m-%d")
+    old_rows = read_csv_rows(company, folder)
+    if not old_rows:
+        print(f"No stored data for {company}, run a full backfill first")
+        return 0
+
+    latest_date = max(row[0] for row in old_rows)
+    from_date = (datetime.strptime(latest_date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    if from_date > to_date:
+        print(f"{company} is already up to date ({latest_date})")
+        return 0
+
+    candles = fetch_price_for_company(company, from_date, to_date, base_url=base_url, raise_errors=True)
+    new_rows = [[str(value) for value in row[:-1]] for row in candles]  # Skip the last value (oi)
+    old_dates = {row[0] for row in old_rows}
+    added = sum(1 for row in new_rows if row[0] not in old_dates)
+    if added:
+        write_csv_atomically(merge_rows(new_rows, old_rows), company, folder)
+    print(f"Added {added} rows to {company}")
+    return added
+
+def refresh(to_date=None, folder=DATA_FOLDER, base_url=None):
+    """
+    Incremental refresh of every company, one small request per ticker. Returns the number of new
+    rows and the companies whose download failed; the others are refreshed either way.
+    """
+    total = 0
+    failed = []
+    for company in INSTRUMENT_KEYS:
+        try:
+            total += refresh_company(company, to_date, folder, base_url)
+        except PriceFetchError:
+            failed.append(company)
+
+    # Keep the memory-mapped price cache in step with the CSVs if one has been built
+    from price_store import PRICE_CACHE_FILE, build_price_cache
+    if total and os.path.exists(os.path.join(folder, PRICE_CACHE_FILE)):
+        build_price_cache(folder)
+    return total, failed
+
 def main():
     for company in INSTRUMENT_KEYS:
         print(f"Fetching data for: {company}")
@@ -70,7 +223,102 @@ def main():
         generate_csv_locally(all_data, company)
         print(f"Saved CSV for {company} with {len(all_data)} rows")
 
-if __name__ == "__main__":
-    main()
+def backfill(workers=DEFAULT_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, folder=DATA_FOLDER, base_url=None, max_retries=5):
+    """
+    Concurrent version of `main`: every (company, date range) request runs on a bounded pool of
+    threads sharing the connection pool and one rate limiter, with retries on 429/5xx. A company
+    whose download fails in any date range keeps its existing CSV.
+    """
+    workers = max(1, min(workers, MAX_WORKERS))
+    rate_limiter = RateLimiter(requests_per_second)
+    date_ranges = [(from_date_3, to_date_3), (from_date_2, to_date_2), (from_date_1, to_date_1)]
+    results = {company: [None] * len(date_ranges) for company in INSTRUMENT_KEYS}
+    total = len(results) * len(date_ranges)
+    done = 0
+    rows = 0
+    written = 0
+    failed = set()
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_price_for_company, company, from_date, to_date, base_url, rate_limiter, max_retries, raise_errors=True): (company, i)
+            for company in results
+            for i, (from_date, to_date) in enumerate(date_ranges)
+        }
+        for future in as_completed(futures):
+            company, i = futures[future]
+            try:
+                results[company][i] = future.result()
+            except PriceFetchError:
+                results[company][i] = []
+                failed.add(company)
+            done += 1
+            rows += len(results[company][i])
+            elapsed = time.perf_counter() - start
+            print(f"[{done}/{total}] {company} done, {done / elapsed:.1f} requests/s, {rows / elapsed:,.0f} rows/s")
+
+            # Newest range first, same order as `main`
+            if company not in failed and all(result is not None for result in results[company]):
+                all_data = [row for result in results[company] for row in result]
+                generate_csv_locally(all_data, company, folder)
+                written += 1
+
+    # Keep the memory-mapped price cache in step with the CSVs if one has been built, like refresh
+    from price_store import PRICE_CACHE_FILE, build_price_cache
+    if written and os.path.exists(os.path.join(folder, PRICE_CACHE_FILE)):
+        build_price_cache(folder)
 
+    elapsed = time.perf_counter() - start
+    print(f"Downloaded {rows:,} rows in {total} requests in {elapsed:.2f}s ({total / elapsed:.1f} requests/s)")
+    if failed:
+        print(f"Failed to download {', '.join(sorted(failed))}, their CSVs were left unchanged")
+    return elapsed
 
+def benchmark(latency=0.05, workers=DEFAULT_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+    """Times the serial backfill against the concurrent one on the local historical-candle stub."""
+    from historical_candle_stub import start_stub_server
+    server, base_url = start_stub_server(latency=latency, throttle_every=25)
+    global BASE_URL
+    default_base_url, BASE_URL = BASE_URL, base_url
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            start = time.perf_counter()
+            for company in INSTRUMENT_KEYS:
+                all_data = []
+                for from_date, to_date in [(from_date_3, to_date_3), (from_date_2, to_date_2), (from_date_1, to_date_1)]:
+                    all_data += fetch_price_for_company(company, from_date, to_date, max_retries=5)
+                generate_csv_locally(all_data, company, folder)
+            serial = time.perf_counter() - start
+            concurrent = backfill(workers, requests_per_second, folder)
+    finally:
+        BASE_URL = default_base_url
+        server.shutdown()
+    print(f"Serial: {serial:.2f}s, concurrent ({workers} workers, {requests_per_second} requests/s): {concurrent:.2f}s, {serial / concurrent:.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download daily candles for the Nifty 50 into stock_price/. By default only the days after each "
+                    "CSV's newest date are fetched; use --full for the complete history. Exits with 1 if any company fails."
+    )
+    parser.add_argument("--full", action="store_true", help="re-download the full history instead of only the missing days")
+    parser.add_argument("--serial", action="store_true", help="run the full download one request at a time")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="concurrent requests for --full")
+    parser.add_argument("--rps", type=float, default=DEFAULT_REQUESTS_PER_SECOND, help="request rate limit for --full")
+    parser.add_argument("--to-date", help="last date to fetch in incremental mode (YYYY-MM-DD), defaults to today")
+    parser.add_argument("--base-url", help=f"historical-candle API host, defaults to {BASE_URL}")
+    parser.add_argument("--benchmark", action="store_true", help="time serial against concurrent downloads on a local stub server")
+    args = parser.parse_args()
+    if args.base_url:
+        BASE_URL = args.base_url
+    if args.benchmark:
+        benchmark(workers=args.workers, requests_per_second=args.rps)
+    elif args.full and args.serial:
+        main()
+    elif args.full:
+        backfill(args.workers, args.rps)
+    else:
+        _, failed = refresh(args.to_date)
+        if failed:
+            print(f"Failed to refresh {', '.join(failed)}")
+            sys.exit(1)
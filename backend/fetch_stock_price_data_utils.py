@@ -1,10 +1,10 @@
 from datetime import datetime
-import pandas as pd
 import os
+from price_store import DATA_FOLDER, get_price_store
 
 nifty_50_companies = ['HDFCBANK', 'RELIANCE', 'ICICIBANK', 'INFY', 'ITC', 'BHARTIARTL', 'TCS', 'LT', 'AXISBANK', 'SBIN', 'M&M', 'KOTAKBANK', 'HINDUNILVR', 'BAJFINANCE', 'NTPC', 'SUNPHARMA', 'TATAMOTORS', 'HCLTECH', 'MARUTI', 'TRENT', 'POWERGRID', 'TITAN', 'ASIANPAINT', 'TATASTEEL', 'BAJAJ-AUTO', 'ULTRACEMCO', 'COALINDIA', 'ONGC', 'HINDALCO', 'BAJAJFINSV', 'ADANIPORTS', 'GRASIM', 'BEL', 'SHRIRAMFIN', 'TECHM', 'JSWSTEEL', 'NESTLEIND', 'INDUSINDBK', 'CIPLA', 'SBILIFE', 'DRREDDY', 'TATACONSUM', 'HDFCLIFE', 'WIPRO', 'ADANIENT', 'HEROMOTOCO', 'BRITANNIA', 'APOLLOHOSP', 'BPCL', 'EICHERMOT']
 
-def get_stock_price(company_name: str, input_date: str, data_folder: str = "./stock_price"):
+def get_stock_price(company_name: str, input_date: str, data_folder: str = DATA_FOLDER):
     """
     Fetches stock price details (Open, High, Low, Close, Volume) for a given company on a specific date.
     
@@ -26,29 +26,21 @@ def get_stock_price(company_name: str, input_date: str, data_folder: str = "./st
         print(f"Error: Symbol not found for {company_name}.")
         return None
 
-    # Construct the file path
-    csv_file = os.path.join(data_folder, f"{company_name}.csv")
-    # Check if the file exists
-    if not os.path.exists(csv_file):
-        print(f"Error: Data file {csv_file} not found.")
+    # Look the ticker up in the in-memory price store
+    prices = get_price_store(data_folder).get(company_name)
+    if prices is None:
+        print(f"Error: Data file {os.path.join(data_folder, f'{company_name}.csv')} not found.")
         return None
 
-    # Read the CSV file
+    # Binary search for the date
     try:
-        df = pd.read_csv(csv_file)
-    except Exception as e:
-        print(f"Error reading {csv_file}: {e}")
-        return None
-
-    # Search for the date
-    stock_data = df[df['Date'] == date]
-    if stock_data.empty:
+        stock_details = prices.get_day(date)
+    except ValueError:
+        stock_details = None
+    if stock_details is None:
         print(f"No data found for {company_name} on {date}.")
         return None
 
-    # Extract required columns
-    stock_details = stock_data.iloc[0][["Open", "High", "Low", "Close", "Volume"]].to_dict()
-
     return stock_details
 
 
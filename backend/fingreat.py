@@ -1,8 +1,8 @@
-from datetime import datetime, timedelta
 import json
 import pandas as pd
 from llm_calls import query_gemini, query_open_ai
-from fetch_stock_price_data_utils import get_stock_price
+from price_store import get_price_store
+from knowledge_graph import get_knowledge_graph
 from similarity_search import search_similar
 from company_financials import generate_financial_report
 import json
@@ -18,44 +18,37 @@ from templates import (
     KG_NODES_MAPPING,
 )
 
-def search_similar_news(news_article):
-    result = search_similar(news_article)
+# Stock ids in the news data's "stocks" field that belong to a Nifty 50 company
+NIFTY_50_NEWS_STOCK_IDS = [sid for sid, ticker in NEWS_COMPANY_TO_KG_TICKER.items() if ticker in NIFTY_50_COMPANIES]
+
+def search_similar_news(news_article, date_of_publish=None):
+    # Only articles published by date_of_publish (no look-ahead) that can yield a few-shot example
+    result = search_similar(news_article, max_date=date_of_publish, tickers=NIFTY_50_NEWS_STOCK_IDS)
     return result
 
 def get_knowledge_graph_summary(news_article, company_ticker):
-    def load_knowledge_graph(filepath):
-        kg = {}
-        with open(filepath, 'r') as file:
-            for line in file:
-                entity1, relation, entity2 = line.strip().strip('()').split(', ')
-                if entity1 not in kg:
-                    kg[entity1] = []
-                kg[entity1].append((relation, entity2))
-        return kg
-    
     def fetch_all_edges(kg, entity):
-        return set([pair[0] for pair in kg.get(entity, [])])
+        return kg.relations(entity)
     
     def fetch_relevant_relations(kg, important_edges):
         relevant_relations = []
-        all_entity_relations = kg.get(KG_NODES_MAPPING[company_ticker], [])
+        all_entity_relations = kg.edges(KG_NODES_MAPPING[company_ticker])
         for edge, entity in all_entity_relations:
             if edge in important_edges:
                 relevant_relations.append((KG_NODES_MAPPING[company_ticker], edge, entity))
         return relevant_relations
 
-    kg_filepath = 'final_kg.txt'
-    kg = load_knowledge_graph(kg_filepath)
+    kg = get_knowledge_graph()
     relations = fetch_all_edges(kg, KG_NODES_MAPPING[company_ticker])
     find_important_relations_prompt = FIND_IMPORTANT_RELATIONS_PROMPT_TEMPLATE.format(relations, KG_NODES_MAPPING[company_ticker], news_article)
-    result = query_gemini(find_important_relations_prompt)
+    result = query_gemini(find_important_relations_prompt, cache_site="kg_relations")
     important_edges = to_json(result)["important_relations"]
 
     fetched_relations = fetch_relevant_relations(kg, important_edges)
     
     summarise_kg_tuples_prompt = SUMMARISE_KG_TUPLES_PROMPT_TEMPLATE.format(fetched_relations)
 
-    result = to_json(query_gemini(summarise_kg_tuples_prompt))
+    result = to_json(query_gemini(summarise_kg_tuples_prompt, cache_site="kg_summary"))
     result = result["summary"]
     
     return result
@@ -74,7 +67,7 @@ def to_json(json_string):
         
 def generate_factors(news_article, company_name):
     prompt = FACTORS_GENERATION_PROMPT_TEMPLATE.format(company_name, news_article)
-    result = to_json(query_gemini(prompt))
+    result = to_json(query_gemini(prompt, cache_site="factors"))
 
     return result["factor"]
 
@@ -83,15 +76,17 @@ def fetch_financials(compay_ticker):
     return financial_report
 
 def get_other_day_stock(company, input_date, previous_day = True):
-    date_str, _ = input_date.split(" ")  
-    result = None
-    counter = 1
-    date = datetime.strptime(date_str, "%Y-%m-%d")
-    while result is None:
-        new_date = date - timedelta(days=counter) if previous_day else date + timedelta(days=counter)
-        result = get_stock_price(company, new_date.strftime("%Y-%m-%d"))
-        counter += 1
-    return result
+    date_str = input_date.split(" ")[0]
+    prices = get_price_store().get(company)
+    if prices is None:
+        print(f"Error: Symbol not found for {company}.")
+        return None
+
+    days = prices.previous_trading_days(date_str, 1) if previous_day else prices.next_trading_days(date_str, 1)
+    if not days:
+        print(f"No {'previous' if previous_day else 'next'} working day found for {company} around {date_str}.")
+        return None
+    return prices.get_day(days[0])
 
 import json
 
@@ -136,32 +131,12 @@ def generate_timeseries_nlp_representations_for_examples(stock_price_last_workin
 
 def get_nlp_representation_last_n_working_days(company, date_time_str):
     date_str, _ = date_time_str.split(" ")  
-    date = datetime.strptime(date_str, "%Y-%m-%d")  
-
-    offsets = [-1, -2, -3, -4, -5] 
+    prices = get_price_store().get(company)
 
     stock_prices = []
-    seen_dates = set()  
-
-    for offset in offsets:
-        counter = offset
-        while True:
-            new_date = date + timedelta(days=counter)  
-            new_date_str = new_date.strftime("%Y-%m-%d")
-            
-            if new_date_str in seen_dates:
-                counter -= 1
-                continue
-
-            print(f"Fetching stock price for {new_date_str}")
-            stock_price = get_stock_price(company, new_date_str)
-
-            if stock_price is not None: 
-                stock_prices.append({"date": new_date_str, "price": stock_price})
-                seen_dates.add(new_date_str) 
-                break  
-
-            counter -= 1
+    if prices is not None:
+        for day in prices.previous_trading_days(date_str, 5):
+            stock_prices.append({"date": day, "price": prices.get_day(day)})
 
     prompt = NLP_REPRESENTATION_LAST_N_DAYS_PROMPT_TEMPLATE.format(stock_prices)
     response = to_json(query_gemini(prompt))
@@ -0,0 +1,89 @@
+import argparse
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+# Local stand-in for Upstox's GET /v2/historical-candle/{instrument_key}/day/{to_date}/{from_date}.
+# It answers with deterministic synthetic weekday candles, newest first, in the same shape as the
+# real endpoint, so the downloaders can be run and timed without a token or network access.
+# `latency` simulates the network round trip and `throttle_every` answers every Nth request with a
+# 429, to exercise the retry path.
+CANDLE_PATH = re.compile(r"^/v2/historical-candle/(?P<key>[^/]+)/(?P<interval>[^/]+)/(?P<to>\d{4}-\d{2}-\d{2})/(?P<from>\d{4}-\d{2}-\d{2})$")
+
+
+def synthetic_candles(instrument_key, from_date, to_date):
+    seed = sum(instrument_key.encode("utf-8")) % 1000 + 100
+    candles = []
+    day = datetime.strptime(to_date, "%Y-%m-%d")
+    first = datetime.strptime(from_date, "%Y-%m-%d")
+    while day >= first:
+        if day.weekday() < 5:
+            base = seed + day.toordinal() % 97
+            candles.append([
+                day.strftime("%Y-%m-%dT00:00:00+05:30"),
+                base, base + 5.5, base - 4.25, base + 1.75, 100000 + day.toordinal() % 5000, 0
+            ])
+        day -= timedelta(days=1)
+    return candles
+
+
+class HistoricalCandleHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = CANDLE_PATH.match(self.path.split("?")[0])
+        if match is None:
+            self._send(404, {"status": "error", "errors": [{"message": "Not found"}]})
+            return
+        with self.server.lock:
+            self.server.requests += 1
+            throttled = self.server.throttle_every and self.server.requests % self.server.throttle_every == 0
+        time.sleep(self.server.latency)
+        if throttled:
+            self._send(429, {"status": "error", "errors": [{"message": "Too many requests"}]}, {"Retry-After": "1"})
+            return
+        candles = synthetic_candles(unquote(match["key"]), match["from"], match["to"])
+        self._send(200, {"status": "success", "data": {"candles": candles}})
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_stub_server(host="127.0.0.1", port=0, latency=0.0, throttle_every=0):
+    server = ThreadingHTTPServer((host, port), HistoricalCandleHandler)
+    server.requests = 0
+    server.lock = threading.Lock()
+    server.latency = latency
+    server.throttle_every = throttle_every
+    return server
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, throttle_every=0):
+    """Starts the stub in a daemon thread and returns (server, base_url). Use port=0 for any free port."""
+    server = make_stub_server(host, port, latency, throttle_every)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Upstox historical-candle endpoint")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering each request")
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every Nth request with a 429")
+    args = parser.parse_args()
+    server = make_stub_server("127.0.0.1", args.port, args.latency, args.throttle_every)
+    print(f"Serving historical candles on http://127.0.0.1:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,88 @@
+import os
+import threading
+
+KG_FILE = "final_kg.txt"
+
+
+class KnowledgeGraph:
+    """
+    The (entity, relation, entity) triples of final_kg.txt, parsed once.
+
+    Every entity and relation name is interned to an integer ID, and the triples are indexed
+    forwards (subject -> relation -> objects), in reverse (object -> subjects) and by relation
+    type (relation -> (subject, object) pairs). Per-subject edges also keep their file order,
+    which is the order the prompts have always listed them in.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self._edges = {}
+        self._forward = {}
+        self._reverse = {}
+        self._by_relation = {}
+
+    def _intern(self, name):
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.ids[name] = name_id
+            self.names.append(name)
+        return name_id
+
+    def add(self, subject, relation, obj):
+        s, r, o = self._intern(subject), self._intern(relation), self._intern(obj)
+        self._edges.setdefault(s, []).append((r, o))
+        self._forward.setdefault(s, {}).setdefault(r, []).append(o)
+        self._reverse.setdefault(o, []).append(s)
+        self._by_relation.setdefault(r, []).append((s, o))
+
+    @classmethod
+    def from_file(cls, filepath=KG_FILE):
+        kg = cls()
+        with open(filepath, 'r') as file:
+            for line in file:
+                parts = line.strip().strip('()').split(', ')
+                if len(parts) != 3:
+                    continue
+                kg.add(*parts)
+        return kg
+
+    def edges(self, entity):
+        """Returns the (relation, object) pairs of `entity` in file order."""
+        names = self.names
+        return [(names[r], names[o]) for r, o in self._edges.get(self.ids.get(entity), [])]
+
+    def relations(self, entity):
+        """Returns the distinct relation names going out of `entity`, in order of first appearance in the file."""
+        return [self.names[r] for r in self._forward.get(self.ids.get(entity), {})]
+
+    def objects(self, entity, relation):
+        forward = self._forward.get(self.ids.get(entity), {})
+        return [self.names[o] for o in forward.get(self.ids.get(relation), [])]
+
+    def subjects(self, obj):
+        """Returns the entities that point at `obj` through any relation."""
+        return [self.names[s] for s in self._reverse.get(self.ids.get(obj), [])]
+
+    def triples_with_relation(self, relation):
+        names = self.names
+        return [(names[s], relation, names[o]) for s, o in self._by_relation.get(self.ids.get(relation), [])]
+
+
+# Global variables (Lazy Loading), reloaded when the file's mtime changes
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+def get_knowledge_graph(filepath=KG_FILE):
+    """Load the knowledge graph only once, and again whenever the file on disk changes."""
+    mtime = os.stat(filepath).st_mtime_ns
+    entry = _graphs.get(filepath)
+    if entry is None or entry[0] != mtime:
+        with _graphs_lock:
+            entry = _graphs.get(filepath)
+            if entry is None or entry[0] != mtime:
+                entry = (mtime, KnowledgeGraph.from_file(filepath))
+                _graphs[filepath] = entry
+                print(f"✅ Loaded {sum(len(e) for e in entry[1]._edges.values())} knowledge graph triples from {filepath}")
+    return entry[1]
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Persistent, content-addressed cache for LLM responses. Entries are keyed on a hash of
+# (model name, full prompt, generation settings), so only a byte-identical request can hit.
+# Call sites opt in by name and each name has its own TTL; the cache as a whole is bounded by
+# LLM_CACHE_MAX_ENTRIES and evicts the least recently used entries first.
+
+LLM_CACHE_FILE = os.getenv("LLM_CACHE_FILE", "llm_cache.sqlite3")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+
+DAY = 24 * 60 * 60
+CALL_SITE_TTLS = {
+    "factors": 30 * DAY,               # FACTORS_GENERATION_PROMPT_TEMPLATE, mostly for historical articles
+    "company_financials": DAY,         # COMPANY_FINANCIALS_PROMPT_TEMPLATE, per ticker
+    "kg_relations": 7 * DAY,           # FIND_IMPORTANT_RELATIONS_PROMPT_TEMPLATE
+    "kg_summary": 7 * DAY,             # SUMMARISE_KG_TUPLES_PROMPT_TEMPLATE
+    "company_background": 7 * DAY,     # get_company_background_information_tool
+}
+
+
+def cache_key(model_name, prompt, settings=None):
+    payload = json.dumps([model_name, prompt, settings or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=LLM_CACHE_FILE, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, call_site TEXT, response TEXT,"
+            " created_at REAL, last_used REAL, expires_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+
+    def get(self, key, call_site):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                self.misses[call_site] = self.misses.get(call_site, 0) + 1
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits[call_site] = self.hits.get(call_site, 0) + 1
+            return row[0]
+
+    def put(self, key, call_site, response, ttl):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, call_site, response, now, now, now + ttl),
+            )
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN"
+                " (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def stats(self):
+        """Hit/miss counters per call site since the process started, plus the number of stored entries."""
+        with self.lock:
+            (entries,) = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        sites = set(self.hits) | set(self.misses)
+        per_site = {}
+        for site in sorted(sites):
+            hits, misses = self.hits.get(site, 0), self.misses.get(site, 0)
+            per_site[site] = {"hits": hits, "misses": misses, "hit_ratio": hits / (hits + misses)}
+        return {"entries": entries, "call_sites": per_site}
+
+
+# Global variable (Lazy Loading)
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
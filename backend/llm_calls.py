@@ -1,10 +1,21 @@
+import asyncio
 import os
+import sys
+import threading
 import time
+import weakref
+from collections import deque
+from datetime import datetime, time as dt_time, timedelta
+from zoneinfo import ZoneInfo
 import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.api_core import exceptions as google_exceptions
+from google.rpc import error_details_pb2
 from dotenv import load_dotenv
 load_dotenv()
 from groq import Groq
 import openai
+from llm_cache import CALL_SITE_TTLS, LLM_CACHE_ENABLED, cache_key, get_response_cache
 
 
 genai.configure(api_key=os.getenv("GEMINI_API_KEY_3"))
@@ -29,51 +40,287 @@ def query_open_ai(prompts, system_prompt=None):
     return response.output[1].content[0].text
 
 
+GEMINI_MODEL = "gemini-2.0-flash-001"
+
+
+# Gemini resets the per-day quotas at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+def next_quota_reset(now):
+    """Epoch seconds of the first midnight in QUOTA_TIMEZONE after epoch seconds `now`."""
+    today = datetime.fromtimestamp(now, QUOTA_TIMEZONE).date()
+    return datetime.combine(today + timedelta(days=1), dt_time(), QUOTA_TIMEZONE).timestamp()
+
+
+class KeyBucket:
+    """
+    Token bucket for one API key: `requests_per_minute` tokens refilled continuously, a
+    `requests_per_day` budget reset at midnight Pacific time, and a cool-off window after a 429.
+    """
+
+    def __init__(self, key, requests_per_minute, requests_per_day):
+        self.key = key
+        self.capacity = requests_per_minute
+        self.refill_per_second = requests_per_minute / 60
+        self.tokens = float(requests_per_minute)
+        self.updated_at = time.monotonic()
+        self.requests_per_day = requests_per_day
+        self.day_ends_at = next_quota_reset(time.time())
+        self.used_today = 0
+        self.backoff_until = 0.0
+        self.strikes = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+        wall_clock = time.time()
+        if wall_clock >= self.day_ends_at:
+            self.day_ends_at, self.used_today = next_quota_reset(wall_clock), 0
+
+    def wait_time(self, now):
+        """Seconds until this key can serve a request, assuming refill() was just called."""
+        if self.used_today >= self.requests_per_day:
+            return self.day_ends_at - time.time()
+        return max(self.backoff_until - now, (1 - self.tokens) / self.refill_per_second, 0.0)
+
+
+class _AsyncWaiter:
+    """A coroutine's place in the APIKeyManager queue, woken by resolving its future on its own loop."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = None
+
+    def wake(self):
+        future = self.future
+        if future is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
 class APIKeyManager:
-    def __init__(self, key_count=8, requests_per_minute=15):
-        self.keys = []
-        self.last_used_times = []
-        
+    """
+    Thread-safe scheduler over the GEMINI_API_KEY_{i} keys. Each key has its own token bucket
+    (GEMINI_RPM / GEMINI_RPD, or GEMINI_API_KEY_{i}_RPM / _RPD per key), requests are served
+    from the key with the most tokens left, and callers that have to wait are served strictly
+    in arrival order.
+    """
+
+    def __init__(self, key_count=8, requests_per_minute=15, requests_per_day=1500):
+        self.buckets = []
+        requests_per_minute = float(os.getenv("GEMINI_RPM", requests_per_minute))
+        requests_per_day = int(os.getenv("GEMINI_RPD", requests_per_day))
+
         # Load API keys
         for i in range(1, key_count + 1):
             key = os.getenv(f"GEMINI_API_KEY_{i}")
             if key:
-                self.keys.append(key)
-                self.last_used_times.append(0)
-        
-        self.current_index = 0
-        self.seconds_per_request = 60 / requests_per_minute
-        
-    def get_next_available_key(self):
-        start_index = self.current_index
-        
-        while True:
-            # Check if enough time has passed for the current key
-            current_time = time.time()
-            time_since_last_use = current_time - self.last_used_times[self.current_index]
-            
-            if time_since_last_use >= self.seconds_per_request:
-                # This key is available
-                key = self.keys[self.current_index]
-                self.last_used_times[self.current_index] = current_time
-                
-                # Move to the next key for the next request
-                self.current_index = (self.current_index + 1) % len(self.keys)
-                
-                return key
-            else:
-                # This key needs more time, try the next one
-                self.current_index = (self.current_index + 1) % len(self.keys)
-                
-                # If we've checked all keys and come back to the start, wait for the first key to become available
-                if self.current_index == start_index:
-                    wait_time = self.seconds_per_request - time_since_last_use + 0.1  # Add a small buffer
-                    time.sleep(wait_time)
+                self.buckets.append(KeyBucket(
+                    key,
+                    float(os.getenv(f"GEMINI_API_KEY_{i}_RPM", requests_per_minute)),
+                    int(os.getenv(f"GEMINI_API_KEY_{i}_RPD", requests_per_day)),
+                ))
+        self.keys = [bucket.key for bucket in self.buckets]
+
+        self.condition = threading.Condition()
+        self.waiters = deque()
+
+    def _take(self):
+        """Takes a token from the fullest usable key. Must hold the lock. Returns (key, 0) or (None, wait)."""
+        now = time.monotonic()
+        best, wait_time = None, float("inf")
+        for bucket in self.buckets:
+            bucket.refill(now)
+            bucket_wait = bucket.wait_time(now)
+            if bucket_wait <= 0 and (best is None or bucket.tokens > best.tokens):
+                best = bucket
+            wait_time = min(wait_time, bucket_wait)
+        if best is None:
+            return None, wait_time
+        best.tokens -= 1
+        best.used_today += 1
+        return best.key, 0
+
+    def get_next_available_key(self, timeout=None):
+        ticket = object()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.waiters.append(ticket)
+            try:
+                while True:
+                    wait_time = None
+                    # Only the head of the queue may take a key, everybody else waits their turn
+                    if self.waiters[0] is ticket:
+                        key, wait_time = self._take()
+                        if key is not None:
+                            return key
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError("No Gemini API key became available in time")
+                        wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                    self.condition.wait(wait_time)
+            finally:
+                self.waiters.remove(ticket)
+                self._notify()
+
+    async def get_next_available_key_async(self, timeout=None):
+        """
+        Same as get_next_available_key, but awaits instead of blocking the thread. Coroutines
+        queue in the same line as the threads and are woken through their event loop.
+        """
+        waiter = _AsyncWaiter(asyncio.get_running_loop())
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.waiters.append(waiter)
+        try:
+            while True:
+                with self.condition:
+                    wait_time = None
+                    if self.waiters[0] is waiter:
+                        key, wait_time = self._take()
+                        if key is not None:
+                            return key
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError("No Gemini API key became available in time")
+                        wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                    # Created under the lock, so a wake-up between here and the await is not lost
+                    waiter.future = waiter.loop.create_future()
+                try:
+                    await asyncio.wait_for(waiter.future, wait_time)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self.condition:
+                self.waiters.remove(waiter)
+                self._notify()
+
+    def _notify(self):
+        """Wakes the waiters after the queue or the buckets changed. Must hold the lock."""
+        self.condition.notify_all()
+        # Only the head of the queue can take a key, so that is the only coroutine worth waking
+        if self.waiters and isinstance(self.waiters[0], _AsyncWaiter):
+            self.waiters[0].wake()
+
+    def report_rate_limited(self, key, retry_after=None):
+        """Called when Gemini answers 429 for `key`: empties its bucket and backs it off exponentially."""
+        with self.condition:
+            for bucket in self.buckets:
+                if bucket.key == key:
+                    bucket.strikes += 1
+                    backoff = retry_after if retry_after is not None else min(2 ** bucket.strikes, 60)
+                    bucket.tokens = 0
+                    bucket.backoff_until = time.monotonic() + backoff
+            self._notify()
+
+    def report_success(self, key):
+        with self.condition:
+            for bucket in self.buckets:
+                if bucket.key == key:
+                    bucket.strikes = 0
+
+    def stats(self):
+        """Current wait time and utilisation of every key, identified by its position in the rotation."""
+        with self.condition:
+            now = time.monotonic()
+            stats = []
+            for i, bucket in enumerate(self.buckets):
+                bucket.refill(now)
+                stats.append({
+                    "key": i + 1,
+                    "wait_seconds": round(bucket.wait_time(now), 3),
+                    "minute_utilisation": round(1 - bucket.tokens / bucket.capacity, 3),
+                    "day_utilisation": round(bucket.used_today / bucket.requests_per_day, 3),
+                    "backed_off": bucket.backoff_until > now,
+                })
+            return {"keys": stats, "queued": len(self.waiters)}
 
 # Initialize the key manager
 key_manager = APIKeyManager()
 
-def query_gemini(prompts, system_prompt=None):
+
+class GeminiClientPool:
+    """
+    One configured GenerativeModel per (API key, model name), created lazily and reused.
+
+    genai.configure() swaps the SDK's global clients, so two threads configuring different keys
+    can send a request on the wrong one. Instead every key gets its own client manager and the
+    models are bound to those clients, leaving the global configuration untouched.
+    """
+
+    def __init__(self, key_manager):
+        self.key_manager = key_manager
+        self.lock = threading.Lock()
+        self.managers = {}
+        self.models = {}
+        self.async_models = weakref.WeakKeyDictionary()
+
+    def _manager(self, api_key):
+        manager = self.managers.get(api_key)
+        if manager is None:
+            manager = genai_client._ClientManager()
+            manager.configure(api_key=api_key)
+            self.managers[api_key] = manager
+        return manager
+
+    def get_model(self, api_key, model_name=GEMINI_MODEL):
+        model = self.models.get((api_key, model_name))
+        if model is None:
+            with self.lock:
+                model = self.models.get((api_key, model_name))
+                if model is None:
+                    model = genai.GenerativeModel(model_name)
+                    # GenerativeModel has no public way to take a client, it otherwise picks up the global one
+                    model._client = self._manager(api_key).get_default_client("generative")
+                    self.models[(api_key, model_name)] = model
+        return model
+
+    def get_async_model(self, api_key, model_name=GEMINI_MODEL):
+        # grpc asyncio channels belong to the event loop they were created on, so pool them per loop
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            models = self.async_models.setdefault(loop, {})
+            model = models.get((api_key, model_name))
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                model._async_client = self._manager(api_key).make_client("generative_async")
+                models[(api_key, model_name)] = model
+        return model
+
+    def checkout(self, model_name=GEMINI_MODEL):
+        """Waits for a key from the key manager and returns it with the model bound to that key."""
+        api_key = self.key_manager.get_next_available_key()
+        return api_key, self.get_model(api_key, model_name)
+
+    async def checkout_async(self, model_name=GEMINI_MODEL):
+        api_key = await self.key_manager.get_next_available_key_async()
+        return api_key, self.get_async_model(api_key, model_name)
+
+client_pool = GeminiClientPool(key_manager)
+
+def retry_delay(error):
+    """Seconds a 429 asks the client to wait (its google.rpc.RetryInfo detail), or None if it doesn't say."""
+    for detail in error.details or []:
+        # gRPC errors carry the parsed message, REST errors the JSON form of it
+        if isinstance(detail, error_details_pb2.RetryInfo):
+            return detail.retry_delay.ToTimedelta().total_seconds()
+        if isinstance(detail, dict) and detail.get("@type", "").endswith("google.rpc.RetryInfo"):
+            try:
+                return float(str(detail.get("retryDelay", "")).rstrip("s"))
+            except ValueError:
+                return None
+    return None
+
+# Times a request is retried on another key after a 429
+RATE_LIMIT_RETRIES = 3
+
+def query_gemini(prompts, system_prompt=None, cache_site=None):
     """
     Queries the Gemini model with an optional system prompt,
     using a rotation of API keys to avoid rate limiting.
@@ -81,28 +328,103 @@ def query_gemini(prompts, system_prompt=None):
     Args:
         prompt (str): The user prompt to send to the model.
         system_prompt (str, optional): System-level instructions to prepend to the user prompt.
+        cache_site (str, optional): Name of the calling site in llm_cache.CALL_SITE_TTLS. Deterministic
+            call sites pass it to reuse an earlier response to the exact same prompt.
 
     Returns:
         str: The model's response.
     """
-    # Get the next available API key
-    api_key = key_manager.get_next_available_key()
-    
-    # Configure genai with the current key
-    genai.configure(api_key=api_key)
-    
-    # Create the model with the current API key
-    model = genai.GenerativeModel("gemini-2.0-flash-001")
-    
     # Combine system prompt and user prompt if system_prompt is provided
     if system_prompt:
         full_prompt = f"{system_prompt}\n\n{prompts}"
     else:
         full_prompt = prompts
 
-    # Send the request
-    response = model.generate_content(full_prompt)
+    cache = get_response_cache() if cache_site and LLM_CACHE_ENABLED else None
+    if cache is not None:
+        key = cache_key(GEMINI_MODEL, full_prompt)
+        cached = cache.get(key, cache_site)
+        if cached is not None:
+            return cached
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        # Get the next available API key together with the model bound to it
+        api_key, model = client_pool.checkout()
+
+        # Send the request, moving on to another key if this one is rate limited
+        try:
+            response = model.generate_content(full_prompt)
+        except google_exceptions.ResourceExhausted as e:
+            key_manager.report_rate_limited(api_key, retry_delay(e))
+            if attempt == RATE_LIMIT_RETRIES:
+                raise
+            continue
+        key_manager.report_success(api_key)
+        break
+
+    if cache is not None:
+        cache.put(key, cache_site, response.text, CALL_SITE_TTLS[cache_site])
+    return response.text
+    
+# Upper bound on Gemini requests awaiting a response at once per event loop
+MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", "64"))
+_in_flight = weakref.WeakKeyDictionary()
+
+def _in_flight_semaphore():
+    # asyncio primitives belong to one event loop, so keep one semaphore per loop
+    loop = asyncio.get_running_loop()
+    semaphore = _in_flight.get(loop)
+    if semaphore is None:
+        semaphore = _in_flight[loop] = asyncio.Semaphore(MAX_IN_FLIGHT)
+    return semaphore
+
+async def query_gemini_async(prompts, system_prompt=None, cache_site=None):
+    """
+    Coroutine version of query_gemini. Waiting for a free key and for the response both happen
+    on the event loop, so many calls can be gathered without a thread per call.
+
+    Args:
+        prompt (str): The user prompt to send to the model.
+        system_prompt (str, optional): System-level instructions to prepend to the user prompt.
+        cache_site (str, optional): Name of the calling site in llm_cache.CALL_SITE_TTLS.
+
+    Returns:
+        str: The model's response.
+    """
+    if system_prompt:
+        full_prompt = f"{system_prompt}\n\n{prompts}"
+    else:
+        full_prompt = prompts
+
+    cache = get_response_cache() if cache_site and LLM_CACHE_ENABLED else None
+    if cache is not None:
+        key = cache_key(GEMINI_MODEL, full_prompt)
+        cached = cache.get(key, cache_site)
+        if cached is not None:
+            return cached
+
+    async with _in_flight_semaphore():
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            api_key, model = await client_pool.checkout_async()
+            try:
+                response = await model.generate_content_async(full_prompt)
+            except google_exceptions.ResourceExhausted as e:
+                key_manager.report_rate_limited(api_key, retry_delay(e))
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise
+                continue
+            key_manager.report_success(api_key)
+            break
+
+    if cache is not None:
+        cache.put(key, cache_site, response.text, CALL_SITE_TTLS[cache_site])
     return response.text
+
+def query_gemini_many(prompts, system_prompt=None, cache_site=None):
+    """Runs many prompts concurrently on one event loop and returns the responses in the same order."""
+    async def gather_all():
+        return await asyncio.gather(*[query_gemini_async(prompt, system_prompt, cache_site) for prompt in prompts])
+    return asyncio.run(gather_all())
     
 # def query_groq(prompt):
 #     time.sleep(5) 
@@ -121,7 +443,32 @@ def query_gemini(prompts, system_prompt=None):
 #     return result
 
 
+def benchmark_client_overhead(n=200):
+    """Per-call client setup cost: configuring and building a fresh model against the pooled one. No requests are sent."""
+    keys = key_manager.keys or ["benchmark-key"]
+
+    start = time.perf_counter()
+    for i in range(n):
+        genai.configure(api_key=keys[i % len(keys)])
+        model = genai.GenerativeModel(GEMINI_MODEL)
+        # The old path also built a new gRPC client on the first request after every configure()
+        model._client = genai_client.get_default_generative_client()
+    fresh = (time.perf_counter() - start) / n
+
+    pool = GeminiClientPool(key_manager)
+    start = time.perf_counter()
+    for i in range(n):
+        pool.get_model(keys[i % len(keys)])
+    pooled = (time.perf_counter() - start) / n
+
+    print(f"configure + new model: {fresh * 1e6:,.0f} us/call")
+    print(f"pooled model:          {pooled * 1e6:,.1f} us/call ({fresh / pooled:,.0f}x)")
+
+
 if __name__ == "__main__":
-    prompt = "Write a hello world program in Python"
-    response = query_gemini(prompt)
-    print(response)
+    if "--benchmark" in sys.argv:
+        benchmark_client_overhead()
+    else:
+        prompt = "Write a hello world program in Python"
+        response = query_gemini(prompt)
+        print(response)
@@ -0,0 +1,296 @@
+import argparse
+import gzip
+import json
+import os
+import struct
+import time
+from functools import cached_property
+import numpy as np
+from google.protobuf.json_format import MessageToDict
+from upstox_client.feeder.proto import MarketDataFeed_pb2 as pb
+from templates import INSTRUMENT_KEYS, INVERSE_INSTRUMENT_KEYS
+
+# Latest prices from the Upstox market data feed. Every instrument has a fixed slot in
+# preallocated arrays and the feed handler copies the ltpc fields straight from the decoded
+# protobuf into them, so a tick allocates nothing.
+#
+# After every frame the store publishes an immutable, versioned PriceSnapshot by swapping one
+# reference. Readers take whatever snapshot is current without locking; the snapshot builds its
+# quotes, JSON body and gzip body once, on first use, and every poll until the next tick reuses
+# them. The version is the ETag, so unchanged polls get a 304.
+#
+# Setting MARKET_FEED_RECORD=<file> makes the feed loop append every raw frame to <file>, to
+# replay later with `python market_feed.py benchmark --frames <file>`.
+
+MARKET_FEED_RECORD = os.getenv("MARKET_FEED_RECORD")
+
+
+def _quote(ltp, cp):
+    # Calculate percent change
+    percent_change = 0
+    if cp > 0:
+        percent_change = round(((ltp - cp) * 100 / cp), 2)
+    return {
+        "price": ltp,
+        "change": round(ltp - cp, 2),
+        "percentage_change": percent_change
+    }
+
+
+class PriceSnapshot:
+    """All quotes at one version. Never modified after the store publishes it. `etag` is unquoted."""
+
+    def __init__(self, version, etag, symbols, ltp, cp, seen):
+        self.created = time.monotonic()
+        self.version = version
+        self.etag = etag
+        self.symbols = symbols
+        self.ltp = ltp
+        self.cp = cp
+        self.seen = seen
+
+    @cached_property
+    def quotes(self):
+        """{symbol: quote} for every symbol that has ticked, the /market_prices format."""
+        ltp, cp = self.ltp.tolist(), self.cp.tolist()
+        return {self.symbols[slot]: _quote(ltp[slot], cp[slot]) for slot in np.flatnonzero(self.seen).tolist()}
+
+    @cached_property
+    def json_bytes(self):
+        return json.dumps(self.quotes, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+    @cached_property
+    def gzip_bytes(self):
+        return gzip.compress(self.json_bytes, compresslevel=6, mtime=0)
+
+
+class MarketPriceStore:
+    def __init__(self, instrument_keys=INSTRUMENT_KEYS, tick_store=None):
+        self.symbols = list(instrument_keys)
+        self.slots = {key: slot for slot, key in enumerate(instrument_keys.values())}
+        self.symbol_slots = {symbol: slot for slot, symbol in enumerate(self.symbols)}
+        capacity = max(len(self.symbols), 1)
+        self.ltp = np.zeros(capacity)
+        self.cp = np.zeros(capacity)
+        self.ltt = np.zeros(capacity, dtype=np.int64)
+        self.seen = np.zeros(capacity, dtype=bool)
+        self.ticks = 0
+        # Optional TickStore that also gets every tick, by slot, for the intraday bars
+        self.tick_store = tick_store
+        # ETags carry the process start so versions from before a restart never match
+        self.epoch = f"{time.time_ns():x}"
+        self.version = 0
+        self.snapshot = self._make_snapshot()
+
+    def _make_snapshot(self):
+        n = len(self.symbols)
+        return PriceSnapshot(
+            self.version, f"{self.epoch}-{self.version}", self.symbols[:n],
+            self.ltp[:n].copy(), self.cp[:n].copy(), self.seen[:n].copy(),
+        )
+
+    def publish(self):
+        """Makes the current prices the snapshot readers see; a single reference swap for them."""
+        self.version += 1
+        self.snapshot = self._make_snapshot()
+
+    def _add_slot(self, instrument_key):
+        """Instruments outside INSTRUMENT_KEYS get a slot on first sight, under their raw key."""
+        slot = len(self.symbols)
+        if slot == len(self.ltp):
+            for name in ("ltp", "cp", "ltt", "seen"):
+                column = getattr(self, name)
+                setattr(self, name, np.concatenate([column, np.zeros_like(column)]))
+        # Readers find a slot through symbol_slots, so everything behind it must exist first
+        if self.tick_store is not None:
+            self.tick_store.ensure(slot)
+        symbol = INVERSE_INSTRUMENT_KEYS.get(instrument_key, instrument_key)
+        self.symbols.append(symbol)
+        self.slots[instrument_key] = slot
+        self.symbol_slots[symbol] = slot
+        return slot
+
+    def apply(self, feed_response):
+        """Copies the ltpc ticks of one decoded FeedResponse into their slots, returns how many there were."""
+        slots = self.slots
+        tick_store = self.tick_store
+        ltp, cp, ltt, seen = self.ltp, self.cp, self.ltt, self.seen
+        count = 0
+        for instrument_key, feed in feed_response.feeds.items():
+            if not feed.HasField("ltpc"):
+                continue
+            slot = slots.get(instrument_key)
+            if slot is None:
+                slot = self._add_slot(instrument_key)
+                ltp, cp, ltt, seen = self.ltp, self.cp, self.ltt, self.seen
+            ltpc = feed.ltpc
+            ltp[slot] = ltpc.ltp
+            cp[slot] = ltpc.cp
+            ltt[slot] = ltpc.ltt
+            seen[slot] = True
+            if tick_store is not None:
+                tick_store.add(slot, ltpc.ltt, ltpc.ltp)
+            count += 1
+        self.ticks += count
+        if count:
+            self.publish()
+        return count
+
+    def get(self, symbol):
+        """Latest published quote of one symbol, or None if it has not ticked yet."""
+        return self.snapshot.quotes.get(symbol)
+
+    def to_dict(self):
+        return dict(self.snapshot.quotes)
+
+
+def decode_protobuf(buffer):
+    """Decode protobuf message."""
+    feed_response = pb.FeedResponse()
+    feed_response.ParseFromString(buffer)
+    return feed_response
+
+
+def write_frame(f, message):
+    f.write(struct.pack("<I", len(message)))
+    f.write(message)
+
+
+def read_frames(path):
+    """Raw frames written by write_frame, in order."""
+    frames = []
+    with open(path, "rb") as f:
+        while header := f.read(4):
+            (length,) = struct.unpack("<I", header)
+            frames.append(f.read(length))
+    return frames
+
+
+def synthetic_frames(n_frames, instrument_keys=INSTRUMENT_KEYS, seed=0):
+    """A full initial frame, then bursts of 1-10 random-walk ticks per frame, like a live session."""
+    rng = np.random.default_rng(seed)
+    keys = list(instrument_keys.values())
+    cp = rng.uniform(100, 5000, len(keys)).round(2)
+    ltp = cp.copy()
+    ltt = 1_700_000_000_000
+    frames = []
+    for i in range(n_frames):
+        response = pb.FeedResponse()
+        response.type = 0 if i == 0 else 1
+        changed = range(len(keys)) if i == 0 else rng.choice(len(keys), rng.integers(1, 11), replace=False)
+        ltt += int(rng.integers(1, 200))
+        for k in changed:
+            ltp[k] = round(ltp[k] * (1 + rng.normal(0, 0.0005)), 2)
+            ltpc = response.feeds[keys[k]].ltpc
+            ltpc.ltp, ltpc.ltt, ltpc.ltq, ltpc.cp = ltp[k], ltt, int(rng.integers(1, 500)), cp[k]
+        frames.append(response.SerializeToString())
+    return frames
+
+
+def apply_message_to_dict(feed_response, market_data):
+    """The previous feed handler, kept as the reference for benchmark()."""
+    data_dict = MessageToDict(feed_response)
+    count = 0
+    if "feeds" in data_dict:
+        for instrument_key, feed_data in data_dict["feeds"].items():
+            if "ltpc" in feed_data:
+                symbol = INVERSE_INSTRUMENT_KEYS.get(instrument_key, instrument_key)
+                ltpc_data = feed_data["ltpc"]
+                ltp = float(ltpc_data.get("ltp", 0))
+                cp = float(ltpc_data.get("cp", 0))
+                percent_change = 0
+                if cp > 0:
+                    percent_change = round(((ltp - cp) * 100 / cp), 2)
+                market_data[symbol] = {
+                    "price": ltp,
+                    "change": round(ltp-cp, 2),
+                    "percentage_change": percent_change
+                }
+                count += 1
+    return count
+
+
+def benchmark(frames, repeats=3):
+    """Ticks per second through decode + MessageToDict handler vs decode + MarketPriceStore.apply."""
+    results = {}
+    for name in ("MessageToDict", "MarketPriceStore"):
+        best = float("inf")
+        for _ in range(repeats):
+            market_data, store = {}, MarketPriceStore()
+            ticks = 0
+            start = time.perf_counter()
+            if name == "MessageToDict":
+                for frame in frames:
+                    ticks += apply_message_to_dict(decode_protobuf(frame), market_data)
+            else:
+                for frame in frames:
+                    ticks += store.apply(decode_protobuf(frame))
+            best = min(best, time.perf_counter() - start)
+        results[name] = ticks / best
+        if name == "MessageToDict":
+            expected = market_data
+        else:
+            assert store.to_dict() == expected, "MarketPriceStore disagrees with the MessageToDict handler"
+    print(f"{len(frames)} frames, {ticks} ticks")
+    for name, rate in results.items():
+        print(f"{name:>16}: {rate:>12,.0f} ticks/s")
+    print(f"{'speedup':>16}: {results['MarketPriceStore'] / results['MessageToDict']:.1f}x")
+
+
+def benchmark_polling(frames, polls_per_frame=100):
+    """
+    Server-side cost of one /market_prices poll while the feed runs: re-serialising the live dict
+    every time, against the snapshot path (a 304 for an unchanged ETag, else its cached body).
+    """
+    store = MarketPriceStore()
+    market_data = {}
+    for frame in frames[:1]:
+        store.apply(decode_protobuf(frame))
+        apply_message_to_dict(decode_protobuf(frame), market_data)
+    decoded = [decode_protobuf(frame) for frame in frames[1:]]
+    polls = len(decoded) * polls_per_frame
+
+    def serialise_every_poll():
+        for feed_response in decoded:
+            apply_message_to_dict(feed_response, market_data)
+            for _ in range(polls_per_frame):
+                json.dumps(market_data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+    def snapshot(client_etag_current, use_gzip):
+        def run():
+            for feed_response in decoded:
+                store.apply(feed_response)
+                etag = None
+                for _ in range(polls_per_frame):
+                    current = store.snapshot
+                    if client_etag_current and etag == current.etag:
+                        continue  # 304
+                    current.gzip_bytes if use_gzip else current.json_bytes
+                    etag = current.etag
+        return run
+
+    cases = {
+        "jsonify every poll": serialise_every_poll,
+        "snapshot, always 200": snapshot(False, False),
+        "snapshot, 200 gzip": snapshot(False, True),
+        "snapshot + ETag/304": snapshot(True, False),
+    }
+    print(f"{len(decoded)} frames, {polls_per_frame} polls per frame, {len(store.snapshot.json_bytes)} byte body "
+          f"({len(store.snapshot.gzip_bytes)} gzipped)")
+    for name, run in cases.items():
+        start = time.perf_counter()
+        run()
+        print(f"{name:>22}: {(time.perf_counter() - start) * 1e6 / polls:>8.2f} µs/poll")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Market feed decoding benchmark")
+    parser.add_argument("command", choices=["benchmark", "benchmark-polling"])
+    parser.add_argument("--frames", help="frames recorded with MARKET_FEED_RECORD")
+    parser.add_argument("--synthetic", type=int, default=50000, help="number of synthetic frames if --frames is not given")
+    args = parser.parse_args()
+    frames = read_frames(args.frames) if args.frames else synthetic_frames(args.synthetic)
+    if args.command == "benchmark":
+        benchmark(frames)
+    else:
+        benchmark_polling(frames[:2000])
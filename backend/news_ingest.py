@@ -0,0 +1,169 @@
+import argparse
+import fcntl
+import os
+import shutil
+import time
+from contextlib import contextmanager
+import faiss
+import numpy as np
+import pandas as pd
+from faiss_index_builder import add_with_ids
+from news_store import (
+    ARTICLE_FIELDS, NEWS_SEGMENTS_DIR, NEWS_STORE_DIR, NewsStore, StringColumn,
+    corpus_size, load_news_store, load_segments, news_store_folder, read_manifest, save_segment,
+    segment_folders, write_manifest,
+)
+from similarity_search import INDEX_FILE, index_file, load_model
+
+# Adds new articles to the similarity search corpus without rebuilding it. Only the new articles
+# are chunked and embedded; each ingest becomes one segment in NEWS_SEGMENTS_DIR that a running
+# server appends to its live index on the next search. `compact` folds the segments into a new
+# generation of the index and store once they pile up, and switches to it through the news manifest.
+#
+#   python news_ingest.py add todays_news.xlsx
+#   python news_ingest.py status
+#   python news_ingest.py compact
+
+# Words per chunk and words shared between consecutive chunks, sized for MiniLM's 256 token limit
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 20
+LOCK_FILE = f"{NEWS_SEGMENTS_DIR}.lock"
+
+
+@contextmanager
+def ingest_lock():
+    """One writer at a time across processes: concurrent ingests would claim the same chunk ids."""
+    with open(LOCK_FILE, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def split_into_chunks(text, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    words = str(text).split()
+    step = chunk_words - overlap
+    return [" ".join(words[start:start + chunk_words]) for start in range(0, max(len(words) - overlap, 1), step)]
+
+
+def read_articles(path):
+    """Reads new articles from .xlsx, .csv, .json or .jsonl with the news_data.xlsx columns."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".xlsx", ".xls"):
+        df = pd.read_excel(path)
+    elif extension == ".csv":
+        df = pd.read_csv(path)
+    elif extension in (".json", ".jsonl"):
+        df = pd.read_json(path, lines=extension == ".jsonl")
+    else:
+        raise ValueError(f"Unsupported article file {path}")
+    missing = [field for field in ARTICLE_FIELDS if field not in df.columns]
+    if missing:
+        raise ValueError(f"{path} is missing columns {missing}")
+    return df[ARTICLE_FIELDS]
+
+
+def ingest(articles, batch_size=64):
+    """
+    Chunks and embeds `articles` (a DataFrame with ARTICLE_FIELDS) and writes them as a new
+    segment. Returns the segment folder, or None if nothing had any text.
+    """
+    start = time.perf_counter()
+    chunks, chunk_article, chunk_position, rows = [], [], [], []
+    with ingest_lock():
+        first_chunk, first_article = corpus_size()
+        for _, article in articles.iterrows():
+            text = article["description"] if isinstance(article["description"], str) else article["title"]
+            if not isinstance(text, str) or not text.strip():
+                print(f"⚠️ Skipping article without text: {article['title']}")
+                continue
+            article_chunks = split_into_chunks(text)
+            chunks.extend(article_chunks)
+            chunk_article.extend([first_article + len(rows)] * len(article_chunks))
+            chunk_position.extend(range(len(article_chunks)))
+            rows.append(article)
+        if not rows:
+            return None
+
+        embeddings = load_model().encode(chunks, batch_size=batch_size).astype(np.float32)
+        segment = NewsStore(
+            np.array(chunk_article, dtype=np.int32),
+            np.array(chunk_position, dtype=np.int32),
+            StringColumn.from_values(chunks),
+            {field: StringColumn.from_values([row[field] for row in rows]) for field in ARTICLE_FIELDS},
+        )
+        folder = save_segment(segment, embeddings, first_chunk, first_article)
+    print(f"✅ Ingested {len(rows)} articles ({len(chunks)} chunks) into {folder} in {time.perf_counter() - start:.1f}s")
+    return folder
+
+
+def _generation_paths(generation):
+    root, extension = os.path.splitext(INDEX_FILE)
+    return f"{root}.{generation}{extension}", f"{NEWS_STORE_DIR}.{generation}"
+
+
+def compact():
+    """
+    Folds all segments into a new generation of the index and store, commits it by rewriting the
+    news manifest, then removes the segments. A crash at any point leaves the manifest on either the
+    old or the new (index, store) pair, and segments already folded in are skipped by chunk id.
+    """
+    with ingest_lock():
+        folders = segment_folders()
+        if not folders:
+            print("No news segments to compact.")
+            return
+        manifest = read_manifest()
+        index = faiss.read_index(index_file(manifest))
+        store = load_news_store(news_store_folder(manifest))
+        for meta, segment, embeddings in load_segments(after_chunk=index.ntotal):
+            if meta["first_chunk"] != index.ntotal or meta["first_article"] != store.num_articles:
+                raise ValueError(f"News segment at chunk {meta['first_chunk']} does not follow the index ({index.ntotal} chunks)")
+            add_with_ids(index, embeddings, np.arange(index.ntotal, index.ntotal + len(embeddings)))
+            store = store.extend(segment)
+
+        # Nothing reads the new generation until the manifest names it, so it is written in place
+        generation = manifest["generation"] + 1 if manifest else 1
+        new_index_file, new_store_folder = _generation_paths(generation)
+        faiss.write_index(index, new_index_file)
+        shutil.rmtree(new_store_folder, ignore_errors=True)
+        os.makedirs(new_store_folder)
+        store.write_files(new_store_folder)
+        write_manifest(generation, new_index_file, new_store_folder)
+
+        for folder in folders:
+            shutil.rmtree(folder)
+        # The previous generation stays for a reader that read the manifest just before the switch
+        if generation > 2:
+            old_index_file, old_store_folder = _generation_paths(generation - 2)
+            if os.path.exists(old_index_file):
+                os.remove(old_index_file)
+            shutil.rmtree(old_store_folder, ignore_errors=True)
+    print(f"✅ Compacted {len(folders)} segments, {new_index_file} now has {index.ntotal} chunks and {store.num_articles} articles")
+
+
+def status():
+    num_chunks, num_articles = corpus_size()
+    folders = segment_folders()
+    print(f"{num_articles} articles, {num_chunks} chunks, {len(folders)} uncompacted segments")
+    for folder in folders:
+        print(f"  {folder}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental news ingestion for similarity search")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="chunk, embed and append new articles")
+    add_parser.add_argument("files", nargs="+", help=".xlsx, .csv, .json or .jsonl with title, description, stocks, date")
+    add_parser.add_argument("--batch-size", type=int, default=64)
+    subparsers.add_parser("compact", help="fold the segments into the base index and news store")
+    subparsers.add_parser("status", help="show corpus size and uncompacted segments")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        ingest(pd.concat([read_articles(path) for path in args.files], ignore_index=True), args.batch_size)
+    elif args.command == "compact":
+        compact()
+    else:
+        status()
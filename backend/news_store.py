@@ -0,0 +1,427 @@
+import argparse
+import ast
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+from price_store import memory_usage
+
+# Compact replacement for chunk_metadata.pkl + news_data.xlsx. A NEWS_STORE_DIR holds:
+#   chunk_article.npy / chunk_position.npy   int32, chunk id -> article id / position in the article
+#   chunk_text.bin + chunk_text_offsets.npy  UTF-8 blob of all chunk texts and int64 start offsets
+#   article_<field>.bin + _offsets.npy       the same for every article column, plus _nulls.npy
+#   meta.json                                counts and column names
+# Every file is memory-mapped, so loading is near-instant and the text is only paged in when read.
+#
+# News ingested after the store was built (news_ingest.py) lives in NEWS_SEGMENTS_DIR, one folder
+# per ingest named after its first chunk id. A segment has the same files as the store, with
+# global article ids in chunk_article.npy, plus the chunk embeddings in embeddings.npy.
+#
+# `news_ingest.py compact` writes the merged FAISS index and store under generation-numbered names
+# and then commits both at once by replacing NEWS_MANIFEST_FILE, so readers that go through the
+# manifest always get an index and a store that match. Before the first compaction there is no
+# manifest and the original index file and NEWS_STORE_DIR are used.
+
+NEWS_STORE_DIR = "news_store"
+NEWS_SEGMENTS_DIR = "news_segments"
+NEWS_MANIFEST_FILE = "news_manifest.json"
+CHUNK_METADATA_FILE = "chunk_metadata.pkl"
+DATA_FILE = "news_data.xlsx"
+ARTICLE_FIELDS = ["title", "description", "stocks", "date"]
+
+
+class StringColumn:
+    """Variable-length strings stored as one UTF-8 blob and an offsets array (n + 1 entries)."""
+
+    def __init__(self, blob, offsets, nulls=None):
+        self.blob = blob
+        self.offsets = offsets
+        self.nulls = nulls
+
+    @classmethod
+    def from_values(cls, values):
+        encoded = []
+        nulls = np.zeros(len(values), dtype=np.uint8)
+        for i, value in enumerate(values):
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                nulls[i] = 1
+                encoded.append(b"")
+            else:
+                encoded.append(str(value).encode("utf-8"))
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets, nulls)
+
+    @classmethod
+    def load(cls, folder, name):
+        offsets = np.load(os.path.join(folder, f"{name}_offsets.npy"), mmap_mode="r")
+        blob_file = os.path.join(folder, f"{name}.bin")
+        if os.path.getsize(blob_file):
+            blob = np.memmap(blob_file, dtype=np.uint8, mode="r")
+        else:
+            blob = np.empty(0, dtype=np.uint8)
+        nulls_file = os.path.join(folder, f"{name}_nulls.npy")
+        nulls = np.load(nulls_file, mmap_mode="r") if os.path.exists(nulls_file) else None
+        return cls(blob, offsets, nulls)
+
+    def save(self, folder, name):
+        np.save(os.path.join(folder, f"{name}_offsets.npy"), np.asarray(self.offsets))
+        with open(os.path.join(folder, f"{name}.bin"), "wb") as f:
+            f.write(np.asarray(self.blob).tobytes())
+        if self.nulls is not None:
+            np.save(os.path.join(folder, f"{name}_nulls.npy"), np.asarray(self.nulls))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if self.nulls is not None and self.nulls[i]:
+            return np.nan
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def take(self, ids):
+        """Values at `ids`, with one gather of the offsets and null flags for all of them."""
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = np.asarray(self.offsets[ids]).tolist()
+        ends = np.asarray(self.offsets[ids + 1]).tolist()
+        nulls = np.asarray(self.nulls[ids]).tolist() if self.nulls is not None else [0] * len(ids)
+        blob = self.blob
+        return [np.nan if null else bytes(blob[start:end]).decode("utf-8") for start, end, null in zip(starts, ends, nulls)]
+
+
+class ConcatColumn:
+    """Several StringColumns read as one, so appending a segment never copies the base blob."""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.starts = np.cumsum([0] + [len(part) for part in parts])
+
+    @classmethod
+    def of(cls, *columns):
+        parts = []
+        for column in columns:
+            parts.extend(column.parts if isinstance(column, ConcatColumn) else [column])
+        return cls(parts)
+
+    def save(self, folder, name):
+        offsets = [np.asarray(self.parts[0].offsets)]
+        for part in self.parts[1:]:
+            offsets.append(np.asarray(part.offsets[1:]) + offsets[-1][-1])
+        nulls = [np.asarray(p.nulls) if p.nulls is not None else np.zeros(len(p), dtype=np.uint8) for p in self.parts]
+        StringColumn(
+            np.concatenate([np.asarray(part.blob) for part in self.parts]),
+            np.concatenate(offsets),
+            np.concatenate(nulls),
+        ).save(folder, name)
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __getitem__(self, i):
+        part = int(np.searchsorted(self.starts, i, side="right")) - 1
+        return self.parts[part][i - int(self.starts[part])]
+
+    def take(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        parts = np.searchsorted(self.starts, ids, side="right") - 1
+        values = [None] * len(ids)
+        for part in np.unique(parts).tolist():
+            where = np.flatnonzero(parts == part)
+            for i, value in zip(where.tolist(), self.parts[part].take(ids[where] - self.starts[part])):
+                values[i] = value
+        return values
+
+
+class NewsStore:
+    """Chunk -> article mapping, chunk texts and article columns behind one array-based interface."""
+
+    def __init__(self, chunk_article, chunk_position, chunk_texts, articles):
+        self.chunk_article = chunk_article
+        self.chunk_position = chunk_position
+        self.chunk_texts = chunk_texts
+        self.articles = articles
+
+    @property
+    def num_chunks(self):
+        return len(self.chunk_article)
+
+    @property
+    def num_articles(self):
+        return len(self.articles[ARTICLE_FIELDS[0]])
+
+    def chunk_text(self, chunk_id):
+        return self.chunk_texts[chunk_id]
+
+    def article(self, article_idx):
+        return {field: column[article_idx] for field, column in self.articles.items()}
+
+    def articles_at(self, article_ids):
+        """Columns of several articles at once, as {field: [value per id]}."""
+        return {field: column.take(article_ids) for field, column in self.articles.items()}
+
+    def extend(self, segment):
+        """Returns a new store with the chunks and articles of `segment` appended after these."""
+        return NewsStore(
+            np.concatenate([self.chunk_article, segment.chunk_article]),
+            np.concatenate([self.chunk_position, segment.chunk_position]),
+            ConcatColumn.of(self.chunk_texts, segment.chunk_texts),
+            {field: ConcatColumn.of(column, segment.articles[field]) for field, column in self.articles.items()},
+        )
+
+    @classmethod
+    def from_legacy(cls, chunk_metadata_file=CHUNK_METADATA_FILE, data_file=DATA_FILE):
+        """Builds the store from the pickled (chunks, article mapping) pair and the Excel sheet."""
+        with open(chunk_metadata_file, "rb") as f:
+            all_chunks, article_mapping = pickle.load(f)
+        df = pd.read_excel(data_file)
+        # The mapping is keyed on chunk text, so look every chunk up exactly the way search_similar did
+        chunk_article = np.array([article_mapping[chunk]["article_idx"] for chunk in all_chunks], dtype=np.int32)
+        chunk_position = np.array([article_mapping[chunk]["chunk_position"] for chunk in all_chunks], dtype=np.int32)
+        articles = {field: StringColumn.from_values(df[field].tolist()) for field in ARTICLE_FIELDS}
+        return cls(chunk_article, chunk_position, StringColumn.from_values(all_chunks), articles)
+
+    @classmethod
+    def load(cls, folder=NEWS_STORE_DIR):
+        with open(os.path.join(folder, "meta.json")) as f:
+            meta = json.load(f)
+        return cls(
+            np.load(os.path.join(folder, "chunk_article.npy"), mmap_mode="r"),
+            np.load(os.path.join(folder, "chunk_position.npy"), mmap_mode="r"),
+            StringColumn.load(folder, "chunk_text"),
+            {field: StringColumn.load(folder, f"article_{field}") for field in meta["article_fields"]},
+        )
+
+    def write_files(self, folder, **extra_meta):
+        np.save(os.path.join(folder, "chunk_article.npy"), np.asarray(self.chunk_article, dtype=np.int32))
+        np.save(os.path.join(folder, "chunk_position.npy"), np.asarray(self.chunk_position, dtype=np.int32))
+        self.chunk_texts.save(folder, "chunk_text")
+        for field, column in self.articles.items():
+            column.save(folder, f"article_{field}")
+        with open(os.path.join(folder, "meta.json"), "w") as f:
+            json.dump({
+                "num_chunks": self.num_chunks,
+                "num_articles": self.num_articles,
+                "article_fields": list(self.articles),
+                **extra_meta,
+            }, f)
+
+    def save(self, folder=NEWS_STORE_DIR):
+        """Writes the store to a temporary folder and swaps it into place."""
+        tmp_folder = f"{folder}.tmp"
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        os.makedirs(tmp_folder)
+        self.write_files(tmp_folder)
+
+        old_folder = f"{folder}.old"
+        shutil.rmtree(old_folder, ignore_errors=True)
+        if os.path.exists(folder):
+            os.replace(folder, old_folder)
+        os.replace(tmp_folder, folder)
+        shutil.rmtree(old_folder, ignore_errors=True)
+
+
+class ArticleFilterIndex:
+    """
+    Publish dates sorted once for range lookups and an inverted index from stock id (the "sid"
+    entries of the stocks column) to article ids. Built from a NewsStore and extended in place
+    when ingested segments are appended to it.
+    """
+
+    def __init__(self):
+        self.num_articles = 0
+        self.dates = np.empty(0, dtype="datetime64[s]")
+        self.date_order = np.empty(0, dtype=np.int64)
+        self.sorted_dates = self.dates
+        self.postings = {}
+
+    def update(self, store):
+        """Indexes the articles of `store` that were added since the last update."""
+        new_ids = range(self.num_articles, store.num_articles)
+        if not new_ids:
+            return
+        dates = pd.to_datetime(pd.Series([store.articles["date"][i] for i in new_ids]), errors="coerce")
+        self.dates = np.concatenate([self.dates, dates.to_numpy(dtype="datetime64[s]")])
+        dated = np.flatnonzero(~np.isnat(self.dates))
+        self.date_order = dated[np.argsort(self.dates[dated], kind="stable")]
+        self.sorted_dates = self.dates[self.date_order]
+
+        new_postings = {}
+        for i in new_ids:
+            try:
+                stocks = ast.literal_eval(store.articles["stocks"][i])
+            except (ValueError, SyntaxError):
+                continue
+            for sid in {stock["sid"] for stock in stocks if isinstance(stock, dict) and "sid" in stock}:
+                new_postings.setdefault(sid, []).append(i)
+        for sid, ids in new_postings.items():
+            self.postings[sid] = np.concatenate([self.postings.get(sid, np.empty(0, dtype=np.int64)), ids])
+        self.num_articles = store.num_articles
+
+    def article_mask(self, min_date=None, max_date=None, tickers=None):
+        """Boolean mask of articles published in [min_date, max_date] that mention any of `tickers`."""
+        mask = np.ones(self.num_articles, dtype=bool)
+        if min_date is not None or max_date is not None:
+            start = 0 if min_date is None else np.searchsorted(self.sorted_dates, np.datetime64(min_date, "s"), "left")
+            end = len(self.sorted_dates) if max_date is None else np.searchsorted(self.sorted_dates, np.datetime64(max_date, "s"), "right")
+            mask[:] = False
+            mask[self.date_order[start:end]] = True
+        if tickers:
+            ticker_mask = np.zeros(self.num_articles, dtype=bool)
+            for ticker in tickers:
+                ticker_mask[self.postings.get(ticker, [])] = True
+            mask &= ticker_mask
+        return mask
+
+
+def read_manifest(manifest_file=NEWS_MANIFEST_FILE):
+    """{"generation", "index_file", "news_store"} of the last compaction, or None if there has been none."""
+    try:
+        with open(manifest_file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(generation, index_file, store_folder, manifest_file=NEWS_MANIFEST_FILE):
+    """Points readers at a new (index, store) pair with a single rename."""
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"generation": generation, "index_file": index_file, "news_store": store_folder}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, manifest_file)
+
+
+def news_store_folder(manifest=None):
+    """The store folder of `manifest` (by default the current one), NEWS_STORE_DIR before the first compaction."""
+    manifest = read_manifest() if manifest is None else manifest
+    return manifest["news_store"] if manifest else NEWS_STORE_DIR
+
+
+def load_news_store(folder=None):
+    """Memory-maps the current store folder if it has been built, otherwise reads the pickle and Excel sheet."""
+    folder = folder or news_store_folder()
+    if os.path.exists(os.path.join(folder, "meta.json")):
+        return NewsStore.load(folder)
+    return NewsStore.from_legacy(CHUNK_METADATA_FILE, DATA_FILE)
+
+
+def save_segment(store, embeddings, first_chunk, first_article, folder=NEWS_SEGMENTS_DIR):
+    """Writes one ingest as a new segment; readers only ever see complete segment folders."""
+    segment_folder = os.path.join(folder, f"{first_chunk:012d}")
+    tmp_folder = f"{segment_folder}.tmp"
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    os.makedirs(tmp_folder)
+    store.write_files(tmp_folder, first_chunk=first_chunk, first_article=first_article)
+    np.save(os.path.join(tmp_folder, "embeddings.npy"), np.ascontiguousarray(embeddings, dtype=np.float32))
+    os.replace(tmp_folder, segment_folder)
+    return segment_folder
+
+
+def segment_folders(folder=NEWS_SEGMENTS_DIR):
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.isdigit()]
+
+
+def load_segments(after_chunk=0, folder=NEWS_SEGMENTS_DIR):
+    """Yields (meta, store, embeddings) for the segments starting at or after `after_chunk`, in order."""
+    for segment_folder in segment_folders(folder):
+        if int(os.path.basename(segment_folder)) < after_chunk:
+            continue  # already applied, or folded into the base store by news_ingest.py compact
+        with open(os.path.join(segment_folder, "meta.json")) as f:
+            meta = json.load(f)
+        embeddings = np.load(os.path.join(segment_folder, "embeddings.npy"))
+        yield meta, NewsStore.load(segment_folder), embeddings
+
+
+def corpus_size(store_folder=None, segments_folder=NEWS_SEGMENTS_DIR):
+    """(num_chunks, num_articles) of the base store plus all segments, read from metadata only."""
+    store_folder = store_folder or news_store_folder()
+    if os.path.exists(os.path.join(store_folder, "meta.json")):
+        with open(os.path.join(store_folder, "meta.json")) as f:
+            meta = json.load(f)
+        num_chunks, num_articles = meta["num_chunks"], meta["num_articles"]
+    else:
+        store = load_news_store(store_folder)
+        num_chunks, num_articles = store.num_chunks, store.num_articles
+    for segment_folder in segment_folders(segments_folder):
+        with open(os.path.join(segment_folder, "meta.json")) as f:
+            meta = json.load(f)
+        num_chunks = max(num_chunks, meta["first_chunk"] + meta["num_chunks"])
+        num_articles = max(num_articles, meta["first_article"] + meta["num_articles"])
+    return num_chunks, num_articles
+
+
+def convert(folder=NEWS_STORE_DIR):
+    """One-time conversion of chunk_metadata.pkl + news_data.xlsx, verified entry by entry against both files."""
+    NewsStore.from_legacy(CHUNK_METADATA_FILE, DATA_FILE).save(folder)
+    store = NewsStore.load(folder)
+
+    # Check the written store against the legacy files themselves, not against from_legacy's reading of them
+    with open(CHUNK_METADATA_FILE, "rb") as f:
+        all_chunks, article_mapping = pickle.load(f)
+    assert store.num_chunks == len(all_chunks), f"{store.num_chunks} chunks, {CHUNK_METADATA_FILE} has {len(all_chunks)}"
+    for i, chunk in enumerate(all_chunks):
+        assert store.chunk_text(i) == chunk, f"chunk {i} text differs"
+        assert store.chunk_article[i] == article_mapping[chunk]["article_idx"], f"chunk {i} article differs"
+        assert store.chunk_position[i] == article_mapping[chunk]["chunk_position"], f"chunk {i} position differs"
+
+    df = pd.read_excel(DATA_FILE)
+    assert store.num_articles == len(df), f"{store.num_articles} articles, {DATA_FILE} has {len(df)}"
+    for i in range(len(df)):
+        row, article = df.iloc[i], store.article(i)
+        for field in ARTICLE_FIELDS:
+            value, stored = row[field], article[field]
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                assert stored != stored, f"article {i} {field} should be empty"
+            else:
+                assert stored == str(value), f"article {i} {field} differs"
+    print(f"✅ Wrote {store.num_chunks} chunks and {store.num_articles} articles to {folder}/")
+
+
+def _measure_startup(source):
+    before = memory_usage()
+    start = time.perf_counter()
+    if source == "legacy":
+        store = NewsStore.from_legacy(CHUNK_METADATA_FILE, DATA_FILE)
+    else:
+        store = NewsStore.load(news_store_folder())
+    load_time = time.perf_counter() - start
+    sample = [store.article(int(i)) for i in store.chunk_article[:100]]
+    after = memory_usage()
+    print(json.dumps({
+        "load_seconds": load_time,
+        "sampled": len(sample),
+        "rss_mb": {field: after[field] - before.get(field, 0) for field in after},
+    }))
+
+
+def benchmark_startup():
+    """Reports load time and memory of the pickle + Excel path against the memory-mapped store."""
+    for source in ("legacy", "store"):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "_startup", source],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        memory = ", ".join(f"{field} +{mb:.1f} MB" for field, mb in result["rss_mb"].items())
+        print(f"{source:>6}: loaded in {result['load_seconds'] * 1000:.1f} ms, {memory}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar, memory-mapped news and chunk store")
+    parser.add_argument("command", choices=["convert", "startup", "_startup"])
+    parser.add_argument("source", nargs="?", default="store")
+    args = parser.parse_args()
+    if args.command == "convert":
+        convert()
+    elif args.command == "startup":
+        benchmark_startup()
+    else:
+        _measure_startup(args.source)
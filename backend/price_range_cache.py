@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import numpy as np
+from fetch_latest_price_for_csv import DATA_FOLDER, PriceFetchError, fetch_price_for_company, merge_rows, read_csv_rows, write_csv_atomically
+from price_store import PRICE_CACHE_FILE, TickerPrices, build_price_cache, get_price_store
+
+# Read-through cache for daily candle ranges. The part of a range covered by the local stock_price
+# data is answered from the price store, only the uncovered tail is fetched from Upstox, and the
+# completed days of that tail are merged into the CSV so the next request finds them locally.
+# Rows keep the Upstox shape ([date, open, high, low, close, volume, oi], newest first) so
+# /time_series_price responses are unchanged.
+
+LRU_SIZE = 256
+# Ranges reaching today can still change (today's candle is live), so they are only reused briefly.
+# "Today" is the exchange's date, whatever timezone the server runs in
+OPEN_RANGE_TTL_SECONDS = 60
+MARKET_TIMEZONE = ZoneInfo("Asia/Kolkata")
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+_persist_lock = threading.Lock()
+# Latest date per ticker already asked of Upstox, so a tail of holidays is not refetched every time
+_remote_checked_until = {}
+# price_cache.bin is rebuilt off the request path; requests made while a rebuild runs coalesce into one more
+_rebuild_requested = threading.Event()
+_rebuild_thread = None
+_rebuild_thread_lock = threading.Lock()
+
+
+def _previous_day(date_str):
+    return (datetime.strptime(date_str, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+
+def _next_day(date_str):
+    return (datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+def _local_rows(prices, from_date, to_date):
+    window = prices.window(from_date, to_date)
+    columns = [
+        window.dates.astype(str).tolist(),
+        window.open.tolist(),
+        window.high.tolist(),
+        window.low.tolist(),
+        window.close.tolist(),
+        window.volume.tolist(),
+    ]
+    return [list(row) + [0] for row in zip(*columns)][::-1]
+
+def _rebuild_price_cache_worker():
+    while True:
+        _rebuild_requested.wait()
+        _rebuild_requested.clear()
+        try:
+            build_price_cache(DATA_FOLDER)
+        except OSError as e:
+            print(f"⚠️ Could not rebuild the price cache: {e}")
+
+def _schedule_price_cache_rebuild():
+    global _rebuild_thread
+    with _rebuild_thread_lock:
+        if _rebuild_thread is None:
+            _rebuild_thread = threading.Thread(target=_rebuild_price_cache_worker, name="price-cache-rebuild", daemon=True)
+            _rebuild_thread.start()
+    _rebuild_requested.set()
+
+def _persist_tail(company, rows, today):
+    """
+    Merges the completed days of a remotely fetched tail into the company's CSV and the price
+    store, and has an existing price_cache.bin rebuilt in the background.
+    """
+    completed = [[str(value) for value in row[:-1]] for row in rows if row[0] < today]
+    if not completed:
+        return
+    with _persist_lock:
+        merged = merge_rows(completed, read_csv_rows(company))
+        write_csv_atomically(merged, company)
+        store = get_price_store()
+        prices = store.get(company)
+        if prices is None or not len(prices):
+            store.tickers[company] = TickerPrices.from_csv(f"{DATA_FOLDER}/{company}.csv")
+        else:
+            # The tail starts after the stored days, so the new days go on the end, oldest first
+            new = sorted(row for row in completed if row[0] > prices.last_date())
+            if new:
+                store.tickers[company] = TickerPrices(
+                    np.concatenate([prices.dates, np.array([row[0] for row in new], dtype="datetime64[D]")]),
+                    *(np.concatenate([column, np.array([row[j] for row in new], dtype=column.dtype)])
+                      for j, column in enumerate([prices.open, prices.high, prices.low, prices.close, prices.volume], start=1)),
+                )
+    # Keep the memory-mapped price cache in step with the CSVs, like refresh() does
+    if os.path.exists(os.path.join(DATA_FOLDER, PRICE_CACHE_FILE)):
+        _schedule_price_cache_rebuild()
+    print(f"Persisted {len(completed)} new rows for {company}")
+
+def _fetch_range(company, from_date, to_date, today):
+    """Returns (rows, complete); complete is False when the remote part could not be fetched."""
+    prices = get_price_store().get(company)
+    if prices is None or not len(prices):
+        try:
+            return fetch_price_for_company(company, from_date, to_date, raise_errors=True), True
+        except PriceFetchError:
+            return [], False
+
+    covered_until = max(prices.last_date(), _remote_checked_until.get(company, ""))
+    rows = _local_rows(prices, from_date, min(to_date, covered_until)) if from_date <= covered_until else []
+    if to_date <= covered_until:
+        return rows, True
+
+    # Only the uncovered tail goes to the network
+    gap_from = max(from_date, _next_day(covered_until))
+    try:
+        tail = fetch_price_for_company(company, gap_from, to_date, raise_errors=True)
+    except PriceFetchError:
+        # Serve what is stored, but ask again next time instead of taking the gap for holidays
+        return rows, False
+    if tail:
+        _persist_tail(company, tail, today)
+    _remote_checked_until[company] = max(_remote_checked_until.get(company, ""), min(to_date, _previous_day(today)))
+    return tail + rows, True
+
+def get_price_range(company, from_date, to_date):
+    """Returns the daily candles of `company` between two 'YYYY-MM-DD' dates (inclusive), newest first."""
+    company = company.upper()
+    from_date, to_date = from_date.split(" ")[0], to_date.split(" ")[0]
+    today = datetime.now(MARKET_TIMEZONE).strftime("%Y-%m-%d")
+    key = (company, from_date, to_date)
+
+    with _lru_lock:
+        entry = _lru.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            _lru.move_to_end(key)
+            return entry[0]
+
+    rows, complete = _fetch_range(company, from_date, to_date, today)
+    if not complete:
+        return rows
+
+    expires_at = time.monotonic() + OPEN_RANGE_TTL_SECONDS if to_date >= today else float("inf")
+    with _lru_lock:
+        _lru[key] = (rows, expires_at)
+        _lru.move_to_end(key)
+        while len(_lru) > LRU_SIZE:
+            _lru.popitem(last=False)
+    return rows
@@ -0,0 +1,403 @@
+import argparse
+import glob
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+DATA_FOLDER = "./stock_price"
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def to_day(date):
+    """
+    Converts a 'YYYY-MM-DD' string (optionally followed by a time part), a date or a datetime
+    into a numpy day.
+    """
+    if isinstance(date, np.datetime64):
+        return date.astype("datetime64[D]")
+    return np.datetime64(str(date)[:10], "D")
+
+
+class TickerPrices:
+    """
+    Date-sorted (ascending) OHLCV columns for a single ticker.
+
+    Every column is a numpy array of the same length, so a row is just an integer position
+    and a date range is a pair of positions found with a binary search.
+    """
+
+    def __init__(self, dates, open_, high, low, close, volume):
+        self.dates = dates
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def from_csv(cls, csv_file):
+        df = pd.read_csv(csv_file)
+        dates = df["Date"].to_numpy(dtype="datetime64[D]")
+        # The CSVs are written newest first and the download windows overlap on the boundary day
+        order = np.argsort(dates, kind="stable")
+        dates = dates[order]
+        keep = np.ones(len(dates), dtype=bool)
+        keep[1:] = dates[1:] != dates[:-1]
+        order = order[keep]
+        return cls(
+            dates[keep],
+            df["Open"].to_numpy(dtype=np.float64)[order],
+            df["High"].to_numpy(dtype=np.float64)[order],
+            df["Low"].to_numpy(dtype=np.float64)[order],
+            df["Close"].to_numpy(dtype=np.float64)[order],
+            df["Volume"].to_numpy(dtype=np.int64)[order],
+        )
+
+    def index_of(self, date):
+        """Returns the row position of `date`, or -1 if there was no trading on that day."""
+        day = to_day(date)
+        i = int(np.searchsorted(self.dates, day))
+        if i < len(self.dates) and self.dates[i] == day:
+            return i
+        return -1
+
+    def row(self, i):
+        return {
+            "Open": float(self.open[i]),
+            "High": float(self.high[i]),
+            "Low": float(self.low[i]),
+            "Close": float(self.close[i]),
+            "Volume": int(self.volume[i]),
+        }
+
+    def get_day(self, date):
+        """Returns the OHLCV dict for `date`, or None if there was no trading on that day."""
+        i = self.index_of(date)
+        return self.row(i) if i >= 0 else None
+
+    def previous_trading_days(self, date, n=1):
+        """
+        Returns up to `n` trading days strictly before `date` as 'YYYY-MM-DD' strings, nearest first.
+
+        `dates` doubles as the ticker's trading calendar, so weekends, holidays and dates
+        outside the data are skipped with a single binary search.
+        """
+        i = int(np.searchsorted(self.dates, to_day(date), side="left"))
+        return [str(day) for day in self.dates[max(i - n, 0):i][::-1]]
+
+    def next_trading_days(self, date, n=1):
+        """Returns up to `n` trading days strictly after `date` as 'YYYY-MM-DD' strings, nearest first."""
+        i = int(np.searchsorted(self.dates, to_day(date), side="right"))
+        return [str(day) for day in self.dates[i:i + n]]
+
+    def window(self, start_date, end_date):
+        """
+        Returns the rows between `start_date` and `end_date` (both inclusive) as a TickerPrices
+        whose columns are views into this one, so no data is copied.
+        """
+        lo = int(np.searchsorted(self.dates, to_day(start_date), side="left"))
+        hi = int(np.searchsorted(self.dates, to_day(end_date), side="right"))
+        return TickerPrices(
+            self.dates[lo:hi],
+            self.open[lo:hi],
+            self.high[lo:hi],
+            self.low[lo:hi],
+            self.close[lo:hi],
+            self.volume[lo:hi],
+        )
+
+    def first_date(self):
+        return str(self.dates[0]) if len(self.dates) else None
+
+    def last_date(self):
+        return str(self.dates[-1]) if len(self.dates) else None
+
+    def to_dataframe(self, newest_first=True):
+        """Returns the rows as a Date, Open, High, Low, Close, Volume DataFrame."""
+        step = -1 if newest_first else 1
+        return pd.DataFrame({
+            "Date": self.dates[::step].astype(str),
+            "Open": self.open[::step],
+            "High": self.high[::step],
+            "Low": self.low[::step],
+            "Close": self.close[::step],
+            "Volume": self.volume[::step],
+        })
+
+
+class PriceStore:
+    """All tickers of a stock_price folder, loaded once and kept in memory."""
+
+    def __init__(self, tickers):
+        self.tickers = tickers
+
+    @classmethod
+    def from_folder(cls, data_folder=DATA_FOLDER):
+        tickers = {}
+        for csv_file in _csv_files(data_folder):
+            ticker = os.path.splitext(os.path.basename(csv_file))[0]
+            try:
+                tickers[ticker] = TickerPrices.from_csv(csv_file)
+            except Exception as e:
+                print(f"Error reading {csv_file}: {e}")
+        return cls(tickers)
+
+    @classmethod
+    def from_cache(cls, cache_file):
+        """
+        Memory-maps a file written by `build_price_cache`. Nothing is parsed or copied, the
+        columns are views into the mapping, so startup is near-instant and every worker process
+        shares the same pages through the OS page cache.
+        """
+        header, buffer = _read_price_cache(cache_file)
+        rows = header["rows"]
+        columns = {
+            name: np.ndarray((rows,), dtype=dtype, buffer=buffer, offset=header["data_offset"] + offset)
+            for name, (dtype, offset) in header["columns"].items()
+        }
+        dates = columns["Date"].view("datetime64[D]")
+        tickers = {}
+        for ticker, start, count in header["tickers"]:
+            end = start + count
+            tickers[ticker] = TickerPrices(
+                dates[start:end],
+                columns["Open"][start:end],
+                columns["High"][start:end],
+                columns["Low"][start:end],
+                columns["Close"][start:end],
+                columns["Volume"][start:end],
+            )
+        return cls(tickers)
+
+    def get(self, ticker):
+        return self.tickers.get(ticker.upper())
+
+    def __contains__(self, ticker):
+        return ticker.upper() in self.tickers
+
+
+# Binary price cache layout: magic, little-endian uint64 header length, JSON header, then one
+# fixed-width column per field for all tickers back to back, each aligned to CACHE_ALIGNMENT.
+# The header holds the per-ticker (start row, row count) offset table.
+PRICE_CACHE_FILE = "price_cache.bin"
+CACHE_MAGIC = b"FGPRICE1"
+CACHE_ALIGNMENT = 64
+CACHE_COLUMNS = [
+    ("Date", "<i8"),
+    ("Open", "<f8"),
+    ("High", "<f8"),
+    ("Low", "<f8"),
+    ("Close", "<f8"),
+    ("Volume", "<i8"),
+]
+
+def _csv_files(data_folder):
+    return sorted(glob.glob(os.path.join(data_folder, "*.csv")))
+
+def _source_fingerprint(data_folder):
+    """Name, size and mtime of every CSV, used to tell whether the cache is stale."""
+    fingerprint = []
+    for csv_file in _csv_files(data_folder):
+        stat = os.stat(csv_file)
+        fingerprint.append([os.path.basename(csv_file), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+def _align(n):
+    return (n + CACHE_ALIGNMENT - 1) // CACHE_ALIGNMENT * CACHE_ALIGNMENT
+
+def build_price_cache(data_folder=DATA_FOLDER, cache_file=None):
+    """
+    Compiles every CSV in `data_folder` into a single memory-mappable file. Safe to rerun
+    whenever the CSVs change, the new file replaces the old one atomically.
+    """
+    cache_file = cache_file or os.path.join(data_folder, PRICE_CACHE_FILE)
+    fingerprint = _source_fingerprint(data_folder)
+    store = PriceStore.from_folder(data_folder)
+
+    table = []
+    rows = 0
+    for ticker, prices in sorted(store.tickers.items()):
+        table.append([ticker, rows, len(prices)])
+        rows += len(prices)
+
+    columns = {}
+    offset = 0
+    for name, dtype in CACHE_COLUMNS:
+        columns[name] = [dtype, offset]
+        offset = _align(offset + rows * np.dtype(dtype).itemsize)
+
+    header = {"rows": rows, "tickers": table, "columns": columns, "sources": fingerprint}
+    # data_offset depends on the header length, so size the header with a placeholder first
+    header["data_offset"] = 0
+    header_len = len(json.dumps(header).encode("utf-8")) + 32
+    header["data_offset"] = _align(len(CACHE_MAGIC) + 8 + header_len)
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header_len)
+
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(CACHE_MAGIC)
+        f.write(struct.pack("<Q", header_len))
+        f.write(header_bytes)
+        for name, dtype in CACHE_COLUMNS:
+            f.write(b"\0" * (header["data_offset"] + columns[name][1] - f.tell()))
+            for ticker, _, _ in table:
+                prices = store.tickers[ticker]
+                column = prices.dates.astype(np.int64) if name == "Date" else getattr(prices, name.lower())
+                f.write(np.ascontiguousarray(column, dtype=dtype).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, cache_file)
+    print(f"✅ Wrote {rows} rows for {len(table)} tickers to {cache_file} ({os.path.getsize(cache_file) / 1e6:.1f} MB)")
+    return cache_file
+
+def _read_price_cache(cache_file):
+    buffer = np.memmap(cache_file, dtype=np.uint8, mode="r")
+    if bytes(buffer[:len(CACHE_MAGIC)]) != CACHE_MAGIC:
+        raise ValueError(f"{cache_file} is not a price cache file")
+    start = len(CACHE_MAGIC)
+    (header_len,) = struct.unpack("<Q", bytes(buffer[start:start + 8]))
+    header = json.loads(bytes(buffer[start + 8:start + 8 + header_len]))
+    return header, buffer
+
+def is_price_cache_fresh(data_folder=DATA_FOLDER, cache_file=None):
+    cache_file = cache_file or os.path.join(data_folder, PRICE_CACHE_FILE)
+    if not os.path.exists(cache_file):
+        return False
+    try:
+        header, _ = _read_price_cache(cache_file)
+    except Exception as e:
+        print(f"Error reading {cache_file}: {e}")
+        return False
+    return header["sources"] == _source_fingerprint(data_folder)
+
+
+# Global variables (Lazy Loading), one store per data folder
+_stores = {}
+_stores_lock = threading.Lock()
+
+def load_price_store(data_folder=DATA_FOLDER):
+    """Memory-maps the binary cache when it is up to date with the CSVs, otherwise parses the CSVs."""
+    cache_file = os.path.join(data_folder, PRICE_CACHE_FILE)
+    if is_price_cache_fresh(data_folder, cache_file):
+        return PriceStore.from_cache(cache_file)
+    if os.path.exists(cache_file):
+        print(f"⚠️ {cache_file} is stale, run `python price_store.py build` to rebuild it")
+    return PriceStore.from_folder(data_folder)
+
+def get_price_store(data_folder=DATA_FOLDER):
+    """Load the price store for `data_folder` only once per process."""
+    key = os.path.abspath(data_folder)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                start = time.perf_counter()
+                store = load_price_store(data_folder)
+                _stores[key] = store
+                print(f"✅ Loaded {len(store.tickers)} tickers into the price store in {time.perf_counter() - start:.3f}s")
+    return store
+
+
+def _legacy_get_stock_price(company_name, date, data_folder=DATA_FOLDER):
+    df = pd.read_csv(os.path.join(data_folder, f"{company_name}.csv"))
+    stock_data = df[df["Date"] == date]
+    if stock_data.empty:
+        return None
+    return stock_data.iloc[0][PRICE_COLUMNS].to_dict()
+
+
+def benchmark(n_lookups=200, seed=0):
+    """Compares single-day lookups per second of the price store against per-call CSV parsing."""
+    store = get_price_store()
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_lookups):
+        ticker = rng.choice(sorted(store.tickers))
+        prices = store.tickers[ticker]
+        queries.append((ticker, str(prices.dates[rng.randrange(len(prices))])))
+
+    start = time.perf_counter()
+    legacy = [_legacy_get_stock_price(ticker, date) for ticker, date in queries]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(100):
+        stored = [store.get(ticker).get_day(date) for ticker, date in queries]
+    store_time = (time.perf_counter() - start) / 100
+
+    assert all(float(a["Close"]) == b["Close"] for a, b in zip(legacy, stored))
+    print(f"CSV parsing:  {n_lookups / legacy_time:,.0f} lookups/s")
+    print(f"Price store:  {n_lookups / store_time:,.0f} lookups/s ({legacy_time / store_time:,.0f}x)")
+
+
+def memory_usage():
+    """Resident memory in MB, split into private (anonymous) and shared file-backed pages on Linux."""
+    usage = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                field, _, value = line.partition(":")
+                if field in ("VmRSS", "RssAnon", "RssFile"):
+                    usage[field] = int(value.split()[0]) / 1024
+    except OSError:
+        import resource
+        usage["MaxRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage
+
+def _measure_startup(source):
+    before = memory_usage()
+    start = time.perf_counter()
+    if source == "cache":
+        store = PriceStore.from_cache(os.path.join(DATA_FOLDER, PRICE_CACHE_FILE))
+    else:
+        store = PriceStore.from_folder(DATA_FOLDER)
+    load_time = time.perf_counter() - start
+    # Touch every row so both stores have all of their data resident
+    checksum = sum(float(prices.close.sum()) for prices in store.tickers.values())
+    after = memory_usage()
+    print(json.dumps({
+        "load_seconds": load_time,
+        "checksum": checksum,
+        "rss_mb": {field: after[field] - before.get(field, 0) for field in after},
+    }))
+
+def benchmark_startup():
+    """Reports cold-start time and memory of CSV parsing against memory-mapping the binary cache."""
+    if not is_price_cache_fresh():
+        build_price_cache()
+    for source in ("csv", "cache"):
+        # A fresh interpreter per source so neither run benefits from the other's allocations
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "_startup", source],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        memory = ", ".join(f"{field} +{mb:.1f} MB" for field, mb in result["rss_mb"].items())
+        print(f"{source:>5}: loaded in {result['load_seconds'] * 1000:.1f} ms, {memory}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-memory stock price store")
+    parser.add_argument("command", nargs="?", default="benchmark",
+                        choices=["build", "benchmark", "startup", "_startup"])
+    parser.add_argument("source", nargs="?", default="csv")
+    args = parser.parse_args()
+    if args.command == "build":
+        build_price_cache()
+    elif args.command == "startup":
+        benchmark_startup()
+    elif args.command == "_startup":
+        _measure_startup(args.source)
+    else:
+        benchmark()
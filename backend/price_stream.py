@@ -0,0 +1,186 @@
+import argparse
+import json
+import threading
+import time
+import numpy as np
+from market_feed import MarketPriceStore, decode_protobuf, read_frames, synthetic_frames
+
+# Push side of the live prices. The feed loop keeps publishing PriceSnapshots on the
+# MarketPriceStore; the hub's dispatcher thread checks for a new version every STREAM_INTERVAL
+# seconds and wakes the subscribers. Each subscriber diffs the newest snapshot against what it
+# last sent and gets only the fields that changed, for the symbols it asked for. Nothing is
+# queued per subscriber: one that falls behind simply diffs against a newer snapshot when it
+# comes back, so its updates coalesce and it can never hold up the feed or the other clients.
+
+STREAM_INTERVAL = 0.1
+KEEPALIVE_SECONDS = 15
+
+
+class Subscription:
+    def __init__(self, hub, symbols=None):
+        self.hub = hub
+        self.symbols = sorted({symbol.upper() for symbol in symbols}) if symbols else None
+        self.version = -1
+        self.sent = {}
+
+    def changes(self, snapshot):
+        """{symbol: {field: value}} of the fields that differ from what this subscriber last received."""
+        changes = {}
+        quotes = snapshot.quotes
+        for symbol in self.symbols or quotes:
+            quote = quotes.get(symbol)
+            if quote is None:
+                continue
+            last = self.sent.get(symbol)
+            changed = quote if last is None else {field: value for field, value in quote.items() if last[field] != value}
+            if changed:
+                changes[symbol] = changed
+                self.sent[symbol] = quote
+        self.version = snapshot.version
+        return changes
+
+    def next_event(self, timeout=None):
+        """Blocks until there are changes for this subscriber, returns (snapshot, changes), or None on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            snapshot = self.hub.wait_for_update(self.version, remaining)
+            if snapshot is None:
+                return None
+            changes = self.changes(snapshot)
+            if changes:
+                return snapshot, changes
+
+
+class PriceStreamHub:
+    def __init__(self, store, interval=STREAM_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.snapshot = store.snapshot
+        self.subscribers = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="price-stream", daemon=True)
+            self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.broadcast()
+
+    def broadcast(self):
+        """Wakes the subscribers if the store has published a new snapshot since the last broadcast."""
+        snapshot = self.store.snapshot
+        if snapshot.version != self.snapshot.version:
+            with self.condition:
+                self.snapshot = snapshot
+                self.condition.notify_all()
+
+    def wait_for_update(self, version, timeout=None):
+        with self.condition:
+            if self.condition.wait_for(lambda: self.snapshot.version != version, timeout):
+                return self.snapshot
+        return None
+
+    def subscribe(self, symbols=None):
+        with self.condition:
+            self.subscribers += 1
+        return Subscription(self, symbols)
+
+    def unsubscribe(self, subscription):
+        with self.condition:
+            self.subscribers -= 1
+
+
+def format_event(snapshot, changes):
+    """One Server-Sent Events message; the id is the snapshot version."""
+    return f"id: {snapshot.version}\nevent: prices\ndata: {json.dumps(changes, separators=(',', ':'))}\n\n"
+
+
+def load_test(n_subscribers=1000, seconds=5.0, frames_per_second=200, slow_fraction=0.1, slow_delay=1.0, seed=0, frames=None):
+    """
+    Replays feed frames at a fixed rate into a store while n_subscribers threads consume the hub,
+    a slow_fraction of them sleeping slow_delay after every event. `frames` are raw frames, such as
+    a MARKET_FEED_RECORD recording (the first seconds * frames_per_second of them are used),
+    synthetic ones if not given. Reports the feed's per-frame cost, and per-group delivery latency
+    (snapshot published -> event built).
+    """
+    rng = np.random.default_rng(seed)
+    store = MarketPriceStore()
+    hub = PriceStreamHub(store).start()
+    n_frames = int(seconds * frames_per_second) + 1
+    if frames is None:
+        frames = synthetic_frames(n_frames, seed=seed)
+    frames = [decode_protobuf(frame) for frame in frames[:n_frames]]
+    symbols = store.symbols
+    stop = threading.Event()
+    stats = {"fast": {"latency": [], "events": 0, "bytes": 0}, "slow": {"latency": [], "events": 0, "bytes": 0}}
+    stats_lock = threading.Lock()
+
+    def subscriber(i):
+        slow = i < n_subscribers * slow_fraction
+        # most clients watch a handful of symbols, every tenth one all of them
+        subset = None if i % 10 == 0 else list(rng.choice(symbols, 5, replace=False))
+        subscription = hub.subscribe(subset)
+        latencies, events, sent_bytes = [], 0, 0
+        while not stop.is_set():
+            event = subscription.next_event(timeout=0.5)
+            if event is None:
+                continue
+            snapshot, changes = event
+            latencies.append(time.monotonic() - snapshot.created)
+            events += 1
+            sent_bytes += len(format_event(snapshot, changes))
+            if slow:
+                time.sleep(slow_delay)
+        hub.unsubscribe(subscription)
+        group = stats["slow" if slow else "fast"]
+        with stats_lock:
+            group["latency"].extend(latencies)
+            group["events"] += events
+            group["bytes"] += sent_bytes
+
+    threads = [threading.Thread(target=subscriber, args=(i,), daemon=True) for i in range(n_subscribers)]
+    for thread in threads:
+        thread.start()
+
+    apply_seconds = 0.0
+    start = time.monotonic()
+    for i, feed_response in enumerate(frames):
+        apply_start = time.perf_counter()
+        store.apply(feed_response)
+        apply_seconds += time.perf_counter() - apply_start
+        time.sleep(max(0.0, start + (i + 1) / frames_per_second - time.monotonic()))
+    elapsed = time.monotonic() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(f"{n_subscribers} subscribers ({slow_fraction:.0%} sleeping {slow_delay}s per event), "
+          f"{len(frames)} frames in {elapsed:.1f}s, feed apply {apply_seconds / len(frames) * 1e6:.1f} µs/frame")
+    for name, group in stats.items():
+        if not group["events"]:
+            continue
+        latency = np.array(group["latency"]) * 1000
+        clients = int(n_subscribers * slow_fraction) if name == "slow" else n_subscribers - int(n_subscribers * slow_fraction)
+        print(f"{name:>5}: {group['events'] / clients / elapsed:6.1f} events/s per client, "
+              f"{group['bytes'] / group['events']:6.0f} B/event, "
+              f"latency p50 {np.percentile(latency, 50):7.1f} ms, p99 {np.percentile(latency, 99):7.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live price streaming hub")
+    parser.add_argument("command", choices=["load-test"])
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--rate", type=int, default=200, help="feed frames per second")
+    parser.add_argument("--slow", type=float, default=0.1, help="fraction of slow subscribers")
+    parser.add_argument("--frames", help="replay frames recorded with MARKET_FEED_RECORD instead of synthetic ones")
+    args = parser.parse_args()
+    load_test(args.subscribers, args.seconds, args.rate, args.slow, frames=read_frames(args.frames) if args.frames else None)
@@ -1,51 +1,410 @@
-import faiss
-import pickle
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 import numpy as np
 import pandas as pd
-from sentence_transformers import SentenceTransformer
+from news_store import NEWS_MANIFEST_FILE, NEWS_SEGMENTS_DIR, ArticleFilterIndex, load_news_store, load_segments, news_store_folder, read_manifest
 
-# Define file paths
-INDEX_FILE = "faiss_index.bin"
-CHUNK_METADATA_FILE = "chunk_metadata.pkl"
-DATA_FILE = "news_data.xlsx"
+# Define file paths. Once news_ingest.py compact has run, the news manifest names the index instead
+INDEX_FILE = os.getenv("FAISS_INDEX_FILE", "faiss_index.bin")
+
+# Query-time knobs for approximate indexes built by faiss_index_builder.py (ignored by flat indexes)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
 
 # Global variables (Lazy Loading)
 _index = None
-_all_chunks = None
-_article_mapping = None
-_df = None
+_news_store = None
 _model = None
+# The news manifest the index and store are loaded from, read once so that both come from the same
+# compaction, and its mtime when it was read; refresh_segments reloads both when a compaction replaces it
+_manifest = None
+_manifest_mtime = None
+# Resources can be loaded by the warm-up thread and by the first search at the same time
+_load_lock = threading.RLock()
+
+def _news_manifest_mtime():
+    try:
+        return os.stat(NEWS_MANIFEST_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+def _loaded_manifest():
+    global _manifest, _manifest_mtime
+    with _load_lock:
+        if _manifest is None:
+            # stat first, so a compaction that lands in between is seen as a change later
+            _manifest_mtime = _news_manifest_mtime()
+            _manifest = read_manifest() or {}
+    return _manifest
+
+def index_file(manifest=None):
+    """The FAISS index of `manifest` (by default the current one), INDEX_FILE before the first compaction."""
+    manifest = read_manifest() if manifest is None else manifest
+    return manifest["index_file"] if manifest else INDEX_FILE
+
+def _read_index(path):
+    # faiss and sentence_transformers are imported on first load, not at module import, so the
+    # app starts serving before warmup pays for them.
+    import faiss
+    from faiss_index_builder import set_search_params
+    index = faiss.read_index(path)
+    set_search_params(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH)
+    return index
+
+def load_index():
+    global _index
+    with _load_lock:
+        if _index is None:
+            _index = _read_index(index_file(_loaded_manifest()))
+    return _index
+
+def load_metadata():
+    global _news_store
+    with _load_lock:
+        if _news_store is None:
+            _news_store = load_news_store(news_store_folder(_loaded_manifest()))
+    return _news_store
+
+def load_model():
+    global _model
+    with _load_lock:
+        if _model is None:
+            from sentence_transformers import SentenceTransformer
+            _model = SentenceTransformer("all-MiniLM-L6-v2")
+    return _model
 
 def load_resources():
     """Load the FAISS index, metadata, and model only once."""
-    global _index, _all_chunks, _article_mapping, _df, _model
-    if _index is None:
-        print("🔄 Loading FAISS index and metadata...")
-        _index = faiss.read_index(INDEX_FILE)
-        with open(CHUNK_METADATA_FILE, "rb") as f:
-            _all_chunks, _article_mapping = pickle.load(f)
-        _df = pd.read_excel(DATA_FILE)
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
-        print(f"✅ Loaded {_index.ntotal} chunks from FAISS index.")
-
-def search_similar(query, top_k=3, chunk_threshold=3):
-    """Search for similar articles based on chunk similarity."""
-    if _index is None:
+    with _load_lock:
+        if _index is None or _news_store is None or _model is None:
+            print("🔄 Loading FAISS index and metadata...")
+            load_index()
+            load_metadata()
+            load_model()
+            print(f"✅ Loaded {_index.ntotal} chunks from FAISS index.")
+
+class _ReadWriteLock:
+    """Searches share the index; appending a news segment to it needs it exclusively."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            while self._writing:
+                self._condition.wait()
+            self._writing = True  # new searches wait from here on, so the writer can't starve
+            while self._readers:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+_search_lock = _ReadWriteLock()
+_segments_mtime = None
+
+def _segments_dir_mtime():
+    try:
+        return os.stat(NEWS_SEGMENTS_DIR).st_mtime_ns
+    except OSError:
+        return None
+
+def _reload_generation(manifest):
+    """Swaps in the index and store a compaction wrote. Must hold _load_lock."""
+    global _index, _news_store
+    index = _read_index(index_file(manifest))
+    store = load_news_store(news_store_folder(manifest))
+    with _search_lock.write():
+        _index, _news_store = index, store
+    with _search_cache_lock:
+        _search_cache.clear()
+    print(f"✅ Switched to compacted news generation {manifest.get('generation')}, FAISS index now has {index.ntotal} chunks.")
+    return index, store
+
+def refresh_segments():
+    """
+    Brings the live index and store up to date with news_ingest.py: switches to a new compacted
+    generation when the news manifest changed (compact deletes the segments it folded in, which
+    this process may not have applied yet), then appends the segments written since. Costs two
+    stat() calls when nothing changed, so every search calls it.
+    """
+    global _news_store, _segments_mtime, _manifest, _manifest_mtime
+    if _segments_dir_mtime() == _segments_mtime and _news_manifest_mtime() == _manifest_mtime:
+        return 0
+    with _load_lock:
+        index, store = load_index(), load_metadata()
+        manifest_mtime = _news_manifest_mtime()
+        mtime = _segments_dir_mtime()
+        if manifest_mtime != _manifest_mtime:
+            manifest = read_manifest() or {}
+            if manifest.get("generation") != _manifest.get("generation"):
+                index, store = _reload_generation(manifest)
+            _manifest, _manifest_mtime = manifest, manifest_mtime
+        elif mtime == _segments_mtime:
+            return 0
+        from faiss_index_builder import add_with_ids
+        added = 0
+        for meta, segment, embeddings in load_segments(after_chunk=index.ntotal):
+            first_chunk = meta["first_chunk"]
+            if first_chunk != index.ntotal or meta["first_article"] != store.num_articles:
+                print(f"⚠️ News segment at chunk {first_chunk} does not follow the index ({index.ntotal} chunks), skipping the rest")
+                break
+            ids = np.arange(first_chunk, first_chunk + len(embeddings), dtype=np.int64)
+            with _search_lock.write():
+                add_with_ids(index, embeddings, ids)
+                store = _news_store = store.extend(segment)
+            added += meta["num_articles"]
+        _segments_mtime = mtime
+    if added:
+        print(f"✅ Added {added} ingested articles, FAISS index now has {index.ntotal} chunks.")
+    return added
+
+# Cache of query embeddings and ranked results, keyed on a hash of the normalised query text.
+# The same article is often analysed several times (for different tickers, on retries), and a
+# hit skips both the MiniLM forward pass and the FAISS search. Cleared when INDEX_FILE or the news
+# manifest changes, or ingested news is added to the index.
+SEARCH_CACHE_SIZE = 512
+_search_cache = OrderedDict()
+_search_cache_lock = threading.Lock()
+_search_cache_index_version = None
+_search_cache_stats = {"embedding_hits": 0, "embedding_misses": 0, "result_hits": 0, "result_misses": 0}
+
+def _query_hash(query):
+    normalised = " ".join(query.lower().split())
+    return hashlib.sha256(normalised.encode("utf-8")).hexdigest()
+
+def _index_version():
+    mtime = None
+    for path in (NEWS_MANIFEST_FILE, INDEX_FILE):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            break
+        except OSError:
+            pass
+    return mtime, _index.ntotal if _index is not None else None
+
+def _cache_entry(query_hash):
+    """Returns the cache entry for a query, creating it if needed. Must hold _search_cache_lock."""
+    global _search_cache_index_version
+    version = _index_version()
+    if version != _search_cache_index_version:
+        _search_cache.clear()
+        _search_cache_index_version = version
+    entry = _search_cache.get(query_hash)
+    if entry is None:
+        entry = _search_cache[query_hash] = {"embedding": None, "results": {}}
+        while len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+    _search_cache.move_to_end(query_hash)
+    return entry
+
+def _encode_cached(queries, batch_size=64):
+    """Embeds the queries, running the model only on those whose embedding is not cached."""
+    hashes = [_query_hash(query) for query in queries]
+    with _search_cache_lock:
+        vectors = [_cache_entry(h)["embedding"] for h in hashes]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        encoded = _model.encode([queries[i] for i in missing], batch_size=batch_size).astype(np.float32)
+        with _search_cache_lock:
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                _cache_entry(hashes[i])["embedding"] = vector
+    with _search_cache_lock:
+        _search_cache_stats["embedding_hits"] += len(queries) - len(missing)
+        _search_cache_stats["embedding_misses"] += len(missing)
+    return hashes, np.stack(vectors)
+
+def _cached_results(query_hash, settings):
+    with _search_cache_lock:
+        results = _cache_entry(query_hash)["results"].get(settings)
+        _search_cache_stats["result_hits" if results is not None else "result_misses"] += 1
+    return list(results) if results is not None else None
+
+def _store_results(query_hash, settings, results):
+    with _search_cache_lock:
+        _cache_entry(query_hash)["results"][settings] = results
+
+def search_cache_stats():
+    """Hit counts and ratios of the embedding and result caches since the process started."""
+    with _search_cache_lock:
+        stats = dict(_search_cache_stats, entries=len(_search_cache))
+    for kind in ("embedding", "result"):
+        lookups = stats[f"{kind}_hits"] + stats[f"{kind}_misses"]
+        stats[f"{kind}_hit_ratio"] = stats[f"{kind}_hits"] / lookups if lookups else 0.0
+    return stats
+
+# Date and ticker filters run inside the FAISS search: the matching articles' chunks become an
+# ID selector, so the whole top_k * chunk_threshold candidate budget goes to eligible chunks.
+_article_filter = ArticleFilterIndex()
+_article_filter_lock = threading.Lock()
+
+def _filter_settings(min_date=None, max_date=None, tickers=None):
+    """Normalised, hashable filters; dates to second precision, tickers sorted."""
+    def to_seconds(value):
+        return None if value is None else str(np.datetime64(pd.Timestamp(value), "s"))
+    return to_seconds(min_date), to_seconds(max_date), tuple(sorted(set(tickers))) if tickers else None
+
+def _chunk_mask(filters):
+    """Chunks whose article passes the filters, or None if unfiltered. Hold _search_lock for reading."""
+    if filters == (None, None, None):
+        return None
+    with _article_filter_lock:
+        _article_filter.update(_news_store)
+        article_mask = _article_filter.article_mask(*filters)
+    return article_mask[_news_store.chunk_article]
+
+def _search_index(query_vectors, k_chunks, chunk_mask=None):
+    if chunk_mask is None:
+        return _index.search(query_vectors, k_chunks)
+    import faiss
+    from faiss_index_builder import search_parameters
+    bitmap = np.packbits(chunk_mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(chunk_mask), faiss.swig_ptr(bitmap))
+    return _index.search(query_vectors, k_chunks, params=search_parameters(_index, selector))
+
+def _aggregate_article_scores(indices, distances, top_k):
+    """
+    Groups one query's chunk hits by article and ranks the articles by their best chunk.
+    Hits are grouped with a stable sort so ties keep the order the articles were first hit in,
+    and only the top_k articles are read from the store, in one gather.
+    """
+    valid = indices != -1
+    chunk_ids, scores = indices[valid], distances[valid]
+    if not len(chunk_ids):
+        return []
+
+    article_ids, first_hit, group = np.unique(
+        np.asarray(_news_store.chunk_article[chunk_ids]), return_index=True, return_inverse=True
+    )
+    order = np.argsort(group, kind="stable")
+    counts = np.bincount(group)
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    grouped_scores, grouped_ids = scores[order], group[order]
+    min_scores = np.minimum.reduceat(grouped_scores, starts)
+    # Sum the j-th hit of every article in pass j: the same float32 additions, in the same order,
+    # as the running total did (add.reduceat sums in a different order and can differ in the last bit)
+    rank = np.arange(len(order)) - np.repeat(starts, counts)
+    total_scores = np.zeros(len(counts), dtype=scores.dtype)
+    for j in range(int(counts.max())):
+        at = rank == j
+        total_scores[grouped_ids[at]] += grouped_scores[at]
+
+    # Best chunk first, ties in the order the articles were first hit
+    top = np.lexsort((first_hit, min_scores))[:top_k].tolist()
+    fields = _news_store.articles_at(article_ids[top])
+    top_hits = [order[starts[g]:starts[g] + counts[g]] for g in top]
+    hit_chunk_ids = chunk_ids[np.concatenate(top_hits)]
+    hit_texts = _news_store.chunk_texts.take(hit_chunk_ids)
+    hit_positions = np.asarray(_news_store.chunk_position[hit_chunk_ids]).tolist()
+
+    results = []
+    offset = 0
+    for i, (g, hits) in enumerate(zip(top, top_hits)):
+        chunks = [
+            {'text': hit_texts[offset + j], 'score': scores[hit], 'position': hit_positions[offset + j]}
+            for j, hit in enumerate(hits.tolist())
+        ]
+        offset += len(hits)
+        results.append({
+            'score': total_scores[g] / np.float32(counts[g]),
+            'min_score': min_scores[g],
+            'chunk_count': int(counts[g]),
+            'article_title': fields["title"][i],
+            'article_description': fields["description"][i],
+            'article_stocks': fields["stocks"][i],
+            'article_date': fields["date"][i],
+            'matched_chunks': sorted(chunks, key=lambda x: x['position'])
+        })
+    return results
+
+def search_similar(query, top_k=3, chunk_threshold=3, min_date=None, max_date=None, tickers=None):
+    """
+    Search for similar articles based on chunk similarity. Optionally only among articles published
+    between min_date and max_date (inclusive) that mention at least one of the `tickers` stock ids.
+    """
+    if _index is None or _news_store is None or _model is None:
         load_resources()  # Ensure resources are loaded before search
+    refresh_segments()
 
-    query_vector = _model.encode([query]).astype(np.float32)
-    
-    # Search for more chunks than top_k to ensure good article coverage
-    k_chunks = min(top_k * chunk_threshold, _index.ntotal)
-    distances, indices = _index.search(query_vector, k_chunks)
+    filters = _filter_settings(min_date, max_date, tickers)
+    settings = (top_k, chunk_threshold, filters)
+    query_hash = _query_hash(query)
+    results = _cached_results(query_hash, settings)
+    if results is not None:
+        return results
+
+    _, query_vector = _encode_cached([query])
     
+    with _search_lock.read():
+        # Search for more chunks than top_k to ensure good article coverage
+        k_chunks = min(top_k * chunk_threshold, _index.ntotal)
+        distances, indices = _search_index(query_vector, k_chunks, _chunk_mask(filters))
+        
+        results = _aggregate_article_scores(indices[0], distances[0], top_k)
+    _store_results(query_hash, settings, results)
+    return list(results)
+
+def search_similar_batch(queries, top_k=3, chunk_threshold=3, batch_size=64, min_date=None, max_date=None, tickers=None):
+    """
+    Search for similar articles for many queries at once. All queries are embedded in batched
+    forward passes and searched with a single FAISS call; returns one result list per query.
+    The filters are the same as search_similar's and apply to every query.
+    """
+    if _index is None or _news_store is None or _model is None:
+        load_resources()  # Ensure resources are loaded before search
+    refresh_segments()
+
+    queries = list(queries)
+    if not queries:
+        return []
+
+    hashes, query_vectors = _encode_cached(queries, batch_size)
+
+    filters = _filter_settings(min_date, max_date, tickers)
+    settings = (top_k, chunk_threshold, filters)
+    batch_results = []
+    with _search_lock.read():
+        k_chunks = min(top_k * chunk_threshold, _index.ntotal)
+        distances, indices = _search_index(query_vectors, k_chunks, _chunk_mask(filters))
+
+        for i, query_hash in enumerate(hashes):
+            results = _aggregate_article_scores(indices[i], distances[i], top_k)
+            _store_results(query_hash, settings, results)
+            batch_results.append(list(results))
+    return batch_results
+
+def _aggregate_article_scores_loop(indices, distances, top_k):
+    """The original per-hit dict implementation, kept as the reference for benchmark_aggregation."""
     # Track article scores
     article_scores = {}
-    for idx, score in zip(indices[0], distances[0]):
+    for idx, score in zip(indices, distances):
         if idx != -1:
-            chunk_text = _all_chunks[idx]
-            chunk_info = _article_mapping[chunk_text]
-            article_idx = chunk_info['article_idx']
+            chunk_text = _news_store.chunk_text(idx)
+            article_idx = int(_news_store.chunk_article[idx])
             
             if article_idx not in article_scores:
                 article_scores[article_idx] = {
@@ -61,17 +420,18 @@ def search_similar(query, top_k=3, chunk_threshold=3):
             article_scores[article_idx]['chunks'].append({
                 'text': chunk_text,
                 'score': score,
-                'position': chunk_info['chunk_position']
+                'position': int(_news_store.chunk_position[idx])
             })
     
     # Prepare results
     results = []
     for article_idx, scores in article_scores.items():
         avg_score = scores['total_score'] / scores['chunk_count']
-        article_title = _df.iloc[article_idx]["title"]
-        article_description = _df.iloc[article_idx]["description"]
-        article_stocks = _df.iloc[article_idx]["stocks"]
-        article_date = _df.iloc[article_idx]["date"]
+        article = _news_store.article(article_idx)
+        article_title = article["title"]
+        article_description = article["description"]
+        article_stocks = article["stocks"]
+        article_date = article["date"]
         
         results.append({
             'score': avg_score,
@@ -87,6 +447,80 @@ def search_similar(query, top_k=3, chunk_threshold=3):
     results.sort(key=lambda x: x['min_score'])
     return results[:top_k]
 
+def benchmark_aggregation(ks=(9, 100, 1000), n_queries=200, top_k=3, seed=0):
+    """Times the array-based aggregation against the dict loop on real search hits, and checks they agree."""
+    load_resources()
+    refresh_segments()
+    rng = np.random.default_rng(seed)
+    chunk_ids = rng.choice(_news_store.num_chunks, min(n_queries, _news_store.num_chunks), replace=False)
+    query_vectors = _model.encode([_news_store.chunk_text(int(i)) for i in chunk_ids]).astype(np.float32)
+
+    print(f"{'k':>6} {'dict loop ms':>13} {'arrays ms':>10} {'speedup':>8}")
+    for k in ks:
+        distances, indices = _index.search(query_vectors, min(k, _index.ntotal))
+        timings = {}
+        outputs = {}
+        for name, aggregate in (("loop", _aggregate_article_scores_loop), ("arrays", _aggregate_article_scores)):
+            start = time.perf_counter()
+            outputs[name] = [aggregate(indices[i], distances[i], top_k) for i in range(len(indices))]
+            timings[name] = (time.perf_counter() - start) * 1000 / len(indices)
+        assert repr(outputs["loop"]) == repr(outputs["arrays"]), f"results differ at k={k}"
+        print(f"{k:>6} {timings['loop']:>13.3f} {timings['arrays']:>10.3f} {timings['loop'] / timings['arrays']:>7.1f}x")
+
+def benchmark_filters(n_queries=200, top_k=3, chunk_threshold=3, seed=0):
+    """
+    Filtering inside the search (ID selector) against searching the whole index and dropping
+    ineligible hits afterwards, both with the same candidate budget and with the budget doubled
+    until top_k eligible articles come back. Corpus chunks stand in for queries.
+    """
+    load_resources()
+    refresh_segments()
+    rng = np.random.default_rng(seed)
+    chunk_ids = rng.choice(_news_store.num_chunks, min(n_queries, _news_store.num_chunks), replace=False)
+    query_vectors = _model.encode([_news_store.chunk_text(int(i)) for i in chunk_ids]).astype(np.float32)
+    k_chunks = min(top_k * chunk_threshold, _index.ntotal)
+
+    with _article_filter_lock:
+        _article_filter.update(_news_store)
+    median_date = _article_filter.sorted_dates[len(_article_filter.sorted_dates) // 2]
+    common_tickers = sorted(_article_filter.postings, key=lambda t: -len(_article_filter.postings[t]))[:10]
+    cases = {
+        "max_date=median": _filter_settings(max_date=median_date),
+        "10 tickers": _filter_settings(tickers=common_tickers),
+        "both": _filter_settings(max_date=median_date, tickers=common_tickers),
+    }
+
+    def eligible_articles(indices, chunk_mask):
+        hits = indices[indices != -1]
+        return len(set(_news_store.chunk_article[hits[chunk_mask[hits]]].tolist()))
+
+    print(f"{'filter':<16} {'eligible':>9} {'method':<22} {'articles':>9} {'ms/query':>9}")
+    for name, filters in cases.items():
+        chunk_mask = _chunk_mask(filters)
+        if chunk_mask is None:
+            continue
+        target = min(top_k, len(set(_news_store.chunk_article[chunk_mask].tolist())))
+        methods = {
+            # the mask is rebuilt per query, as search_similar does
+            "pre-filter": lambda q: _search_index(q, k_chunks, _chunk_mask(filters))[1][0],
+            "post-filter": lambda q: _index.search(q, k_chunks)[1][0],
+        }
+
+        def post_filter_until_full(q):
+            k = k_chunks
+            while True:
+                indices = _index.search(q, k)[1][0]
+                if eligible_articles(indices, chunk_mask) >= target or k >= _index.ntotal:
+                    return indices
+                k = min(k * 2, _index.ntotal)
+        methods["post-filter, refetch"] = post_filter_until_full
+
+        for method, search in methods.items():
+            start = time.perf_counter()
+            found = [min(eligible_articles(search(query_vectors[i:i + 1]), chunk_mask), top_k) for i in range(len(query_vectors))]
+            elapsed = (time.perf_counter() - start) * 1000 / len(query_vectors)
+            print(f"{name:<16} {chunk_mask.mean():>9.1%} {method:<22} {np.mean(found):>9.2f} {elapsed:>9.3f}")
+
 def display_results(results, show_chunks=False):
     """Pretty print search results"""
     print("\n🔍 Top Similar Articles:")
@@ -104,3 +538,17 @@ def display_results(results, show_chunks=False):
             for chunk in result['matched_chunks']:
                 print(f"\nChunk {chunk['position']+1} (Score: {chunk['score']:.4f}):")
                 print(chunk['text'])
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Similarity search benchmarks")
+    parser.add_argument("command", choices=["benchmark-filters", "benchmark-aggregation"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--chunk-threshold", type=int, default=3)
+    args = parser.parse_args()
+    if args.command == "benchmark-filters":
+        benchmark_filters(args.queries, args.top_k, args.chunk_threshold)
+    else:
+        benchmark_aggregation(n_queries=args.queries, top_k=args.top_k)
@@ -0,0 +1,49 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Stage:
+    """
+    One step of a pipeline. `fn` is called with the results of `deps`, in order, as positional
+    arguments. `message` is the progress line for when the stage completes, either a string or a
+    function of the stage's result.
+    """
+
+    def __init__(self, name, fn, deps=(), message=None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.message = message
+
+    def completion_message(self, result):
+        return self.message(result) if callable(self.message) else self.message
+
+
+def run_stage_graph(stages, max_workers=None):
+    """
+    Runs a DAG of stages, starting each one as soon as all of its dependencies have finished.
+    Yields (stage, result) in completion order, so the total latency follows the critical path
+    instead of the sum of all stages. An exception in a stage is raised to the caller.
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in names]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages {missing}")
+
+    results = {}
+    pending = list(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as executor:
+        while pending or running:
+            for stage in [s for s in pending if all(dep in results for dep in s.deps)]:
+                pending.remove(stage)
+                future = executor.submit(stage.fn, *[results[dep] for dep in stage.deps])
+                running[future] = stage
+            if not running:
+                raise ValueError(f"Stages {[s.name for s in pending]} have cyclic dependencies")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name] = future.result()
+                yield stage, results[stage.name]
@@ -0,0 +1,92 @@
+import hashlib
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+
+import faiss
+import news_ingest
+import similarity_search
+from news_store import ARTICLE_FIELDS, ArticleFilterIndex, NewsStore, StringColumn, corpus_size
+
+
+class HashEncoder:
+    """Stands in for MiniLM: a fixed pseudo-random vector per text."""
+
+    def encode(self, texts, batch_size=64):
+        return np.stack([
+            np.random.default_rng(int(hashlib.sha256(text.encode()).hexdigest()[:8], 16)).normal(size=8)
+            for text in texts
+        ]).astype(np.float32)
+
+
+def articles(prefix, n, words=150):
+    return pd.DataFrame({
+        "title": [f"{prefix} {i}" for i in range(n)],
+        "description": [" ".join(f"{prefix}{i}w{j}" for j in range(words)) for i in range(n)],
+        "stocks": ["[{'sid': 'TCS'}]"] * n,
+        "date": ["2025-01-02 10:00:00"] * n,
+    })
+
+
+@pytest.fixture
+def live_server(tmp_path, monkeypatch):
+    """A base corpus of 5 articles / 10 chunks in tmp_path, loaded the way the server loads it."""
+    monkeypatch.chdir(tmp_path)
+    encoder = HashEncoder()
+    for name, value in [
+        ("_index", None), ("_news_store", None), ("_model", encoder), ("_manifest", None),
+        ("_manifest_mtime", None), ("_segments_mtime", None), ("_article_filter", ArticleFilterIndex()),
+    ]:
+        monkeypatch.setattr(similarity_search, name, value)
+    similarity_search._search_cache.clear()
+
+    base = articles("base", 5)
+    chunks, chunk_article, chunk_position = [], [], []
+    for i, text in enumerate(base["description"]):
+        article_chunks = news_ingest.split_into_chunks(text)
+        chunks.extend(article_chunks)
+        chunk_article.extend([i] * len(article_chunks))
+        chunk_position.extend(range(len(article_chunks)))
+    index = faiss.IndexFlatL2(8)
+    index.add(encoder.encode(chunks))
+    faiss.write_index(index, similarity_search.INDEX_FILE)
+    NewsStore(
+        np.array(chunk_article, dtype=np.int32),
+        np.array(chunk_position, dtype=np.int32),
+        StringColumn.from_values(chunks),
+        {field: StringColumn.from_values(base[field].tolist()) for field in ARTICLE_FIELDS},
+    ).save()
+
+    similarity_search.load_resources()
+    assert similarity_search._index.ntotal == 10
+    return similarity_search
+
+
+def test_live_index_follows_ingest_compact_ingest(live_server):
+    news_ingest.ingest(articles("first", 2))
+    assert live_server.refresh_segments() == 2
+
+    # The next ingest is compacted before the server sees it, so its segment is gone by then
+    news_ingest.ingest(articles("second", 1))
+    news_ingest.compact()
+    news_ingest.ingest(articles("third", 1))
+
+    live_server.refresh_segments()
+    num_chunks, num_articles = corpus_size()
+    assert live_server._index.ntotal == num_chunks
+    assert live_server._news_store.num_articles == num_articles == 9
+
+    results = live_server.search_similar(news_ingest.split_into_chunks(articles("third", 1)["description"][0])[0], top_k=1)
+    assert results[0]["article_title"] == "third 0"
+
+
+def test_search_cache_is_cleared_on_compaction(live_server):
+    query = articles("base", 1)["description"][0]
+    live_server.search_similar(query)
+    news_ingest.ingest(articles("new", 1))
+    news_ingest.compact()
+    live_server.refresh_segments()
+    assert len(live_server._search_cache) == 0
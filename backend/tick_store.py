@@ -0,0 +1,208 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+# Intraday history of the live feed, in fixed memory. Every instrument has a preallocated ring of
+# its last TICK_BUFFER_SIZE ticks (exchange timestamp, LTP and the running sum of LTPs, so the
+# mean price over any span in the ring is two lookups) and a ring of OHLC bars per interval in
+# BAR_INTERVALS, updated as each tick arrives. A tick costs the same O(1) work however long the
+# session runs, and nothing is allocated after start-up except for instruments first seen mid-session.
+
+TICK_BUFFER_SIZE = int(os.getenv("TICK_BUFFER_SIZE", "8192"))
+BAR_INTERVALS = {"1m": 60, "5m": 5 * 60, "15m": 15 * 60}
+# An NSE session is 375 minutes, so this keeps at least the whole day at every interval
+BARS_PER_INTERVAL = 400
+IST = timezone(timedelta(hours=5, minutes=30))
+
+
+class TickRing:
+    def __init__(self, capacity=TICK_BUFFER_SIZE):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)  # ms since epoch
+        self.ltp = np.zeros(capacity)
+        self.cumulative_price = np.zeros(capacity)
+        self.count = 0  # ticks ever appended; the newest is at (count - 1) % capacity
+        self.total = 0.0
+
+    def append(self, timestamp, ltp):
+        i = self.count % self.capacity
+        self.total += ltp
+        self.timestamps[i] = timestamp
+        self.ltp[i] = ltp
+        self.cumulative_price[i] = self.total
+        self.count += 1
+
+    def _order(self):
+        """Ring positions of the retained ticks, oldest first."""
+        if self.count <= self.capacity:
+            return np.arange(self.count)
+        return np.roll(np.arange(self.capacity), -(self.count % self.capacity))
+
+    def ticks(self):
+        """(timestamps, ltp) of the retained ticks, oldest first."""
+        order = self._order()
+        return self.timestamps[order], self.ltp[order]
+
+    def mean_price(self, since):
+        """Mean LTP of the retained ticks at or after `since` (ms), or None if there are none. Needs ticks in time order."""
+        order = self._order()
+        first = int(np.searchsorted(self.timestamps[order], since, side="left"))
+        if first == len(order):
+            return None
+        before = self.cumulative_price[order[first - 1]] if first else self.cumulative_price[order[0]] - self.ltp[order[0]]
+        return float((self.cumulative_price[order[-1]] - before) / (len(order) - first))
+
+
+class BarRing:
+    """OHLC bars of one interval, the newest one updated in place until a tick opens the next."""
+
+    def __init__(self, seconds, capacity=BARS_PER_INTERVAL):
+        self.milliseconds = seconds * 1000
+        self.capacity = capacity
+        self.start = np.zeros(capacity, dtype=np.int64)
+        self.open = np.zeros(capacity)
+        self.high = np.zeros(capacity)
+        self.low = np.zeros(capacity)
+        self.close = np.zeros(capacity)
+        self.ticks = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+        # The open bar is mirrored in plain Python values, so a tick only writes to the arrays
+        self.current = None
+        self.current_high = self.current_low = 0.0
+        self.current_ticks = 0
+
+    def update(self, timestamp, price):
+        """Adds a tick no older than the previous one (InstrumentTicks drops late ticks before they get here)."""
+        # Epoch-aligned buckets; IST is UTC+5:30, a whole number of 15 minute periods
+        bucket = timestamp - timestamp % self.milliseconds
+        i = (self.count - 1) % self.capacity
+        if bucket == self.current:
+            if price > self.current_high:
+                self.current_high = self.high[i] = price
+            if price < self.current_low:
+                self.current_low = self.low[i] = price
+            self.close[i] = price
+            self.current_ticks += 1
+            self.ticks[i] = self.current_ticks
+        else:
+            i = self.count % self.capacity
+            self.start[i] = self.current = bucket
+            self.open[i] = self.high[i] = self.low[i] = self.close[i] = price
+            self.current_high = self.current_low = price
+            self.ticks[i] = self.current_ticks = 1
+            self.count += 1
+
+    def bars(self):
+        """(start, ohlc, ticks) of the retained bars, newest first."""
+        n = min(self.count, self.capacity)
+        order = (self.count - 1 - np.arange(n)) % self.capacity
+        ohlc = np.stack([self.open[order], self.high[order], self.low[order], self.close[order]], axis=1)
+        return self.start[order], ohlc, self.ticks[order]
+
+
+class InstrumentTicks:
+    def __init__(self, tick_capacity=TICK_BUFFER_SIZE, bar_capacity=BARS_PER_INTERVAL):
+        self.ring = TickRing(tick_capacity)
+        self.bar_rings = {name: BarRing(seconds, bar_capacity) for name, seconds in BAR_INTERVALS.items()}
+        self._bar_rings = list(self.bar_rings.values())
+        # Bumped before and after every write (a seqlock), so readers on other threads can tell a
+        # torn copy from a consistent one without the feed ever taking a lock
+        self.sequence = 0
+        # Ticks older than the newest one seen are counted and dropped: the ring has to stay sorted
+        # for mean_price, and a late tick must not become the close of a bar
+        self.last_timestamp = 0
+        self.late_ticks = 0
+
+    def add(self, timestamp, ltp):
+        if timestamp < self.last_timestamp:
+            self.late_ticks += 1
+            return
+        self.last_timestamp = timestamp
+        self.sequence += 1
+        self.ring.append(timestamp, ltp)
+        for bar_ring in self._bar_rings:
+            bar_ring.update(timestamp, ltp)
+        self.sequence += 1
+
+    def read(self, fn):
+        """Runs fn() until it saw no concurrent write, returns its result."""
+        while True:
+            sequence = self.sequence
+            if sequence % 2 == 0:
+                result = fn()
+                if self.sequence == sequence:
+                    return result
+            time.sleep(0)
+
+
+class TickStore:
+    """InstrumentTicks per MarketPriceStore slot, allocated up front for the known instruments."""
+
+    def __init__(self, n_instruments, tick_capacity=TICK_BUFFER_SIZE, bar_capacity=BARS_PER_INTERVAL):
+        self.tick_capacity = tick_capacity
+        self.bar_capacity = bar_capacity
+        self.instruments = [InstrumentTicks(tick_capacity, bar_capacity) for _ in range(n_instruments)]
+
+    def ensure(self, slot):
+        """Allocates the instruments up to `slot`, before anything hands that slot to a reader."""
+        if slot >= len(self.instruments):
+            self.instruments.extend(InstrumentTicks(self.tick_capacity, self.bar_capacity) for _ in range(slot + 1 - len(self.instruments)))
+
+    def add(self, slot, timestamp, ltp):
+        self.ensure(slot)
+        if not timestamp:
+            timestamp = time.time_ns() // 1_000_000
+        self.instruments[slot].add(timestamp, ltp)
+
+    def bars(self, slot, interval):
+        """
+        Bars of one instrument as [timestamp, open, high, low, close, ticks] rows, newest first like
+        Upstox candles, with IST ISO timestamps. `ticks` is the number of feed updates in the bar.
+        """
+        instrument = self.instruments[slot]
+        bar_ring = instrument.bar_rings[interval]
+        start, ohlc, ticks = instrument.read(bar_ring.bars)
+        return [
+            [datetime.fromtimestamp(ms / 1000, IST).isoformat(), *bar, n]
+            for ms, bar, n in zip(start.tolist(), ohlc.tolist(), ticks.tolist())
+        ]
+
+    def memory_mb(self):
+        total = 0
+        for instrument in self.instruments:
+            ring = instrument.ring
+            total += ring.timestamps.nbytes + ring.ltp.nbytes + ring.cumulative_price.nbytes
+            for bar_ring in instrument._bar_rings:
+                total += sum(column.nbytes for column in (
+                    bar_ring.start, bar_ring.open, bar_ring.high, bar_ring.low, bar_ring.close, bar_ring.ticks,
+                ))
+        return total / 1e6
+
+
+def benchmark(n_ticks=1_000_000, n_instruments=50, seed=0):
+    """Per-tick cost at the start and after the rings have wrapped many times, and the memory used."""
+    rng = np.random.default_rng(seed)
+    store = TickStore(n_instruments)
+    slots = rng.integers(0, n_instruments, n_ticks).tolist()
+    timestamps = (1_700_000_000_000 + np.cumsum(rng.integers(0, 50, n_ticks))).tolist()
+    prices = (1000 * np.exp(np.cumsum(rng.normal(0, 0.0002, n_ticks)))).round(2).tolist()
+    chunk = n_ticks // 10
+    print(f"{n_instruments} instruments, {store.tick_capacity} ticks and {store.bar_capacity} bars per interval each, "
+          f"{store.memory_mb():.1f} MB preallocated")
+    for part in range(10):
+        start = time.perf_counter()
+        for i in range(part * chunk, (part + 1) * chunk):
+            store.add(slots[i], timestamps[i], prices[i])
+        elapsed = time.perf_counter() - start
+        print(f"ticks {part * chunk:>9,}-{(part + 1) * chunk:>9,}: {elapsed / chunk * 1e6:.2f} µs/tick")
+    print(f"memory after {n_ticks:,} ticks: {store.memory_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-instrument tick rings and intraday bars")
+    parser.add_argument("command", choices=["benchmark"])
+    parser.add_argument("--ticks", type=int, default=1_000_000)
+    args = parser.parse_args()
+    benchmark(args.ticks)
@@ -3,7 +3,8 @@ import pandas as pd
 import os
 import requests
 from company_financials import generate_financial_report
-from fetch_latest_price_for_csv import fetch_price_for_company
+from price_range_cache import get_price_range
+from knowledge_graph import get_knowledge_graph
 from templates import KG_NODES_MAPPING
 from llm_calls import query_gemini
 import json
@@ -22,7 +23,7 @@ def get_stock_price_range_tool(company_name: str, start_date: str, end_date: str
     Returns:
     - DataFrame: Stock price details (Date, Open, High, Low, Close, Volume) or None if not found.
     """
-    result = fetch_price_for_company(company_name, start_date, end_date)
+    result = get_price_range(company_name, start_date, end_date)
     columns = ["Date", "Open", "High", "Low", "Close", "Volume", "0"]
     stock_data = pd.DataFrame(result, columns=columns)
     return stock_data[["Date", "Open", "High", "Low", "Close", "Volume"]]
@@ -31,21 +32,10 @@ def get_company_financials_tool(company):
     return generate_financial_report(company)
 
 def get_company_background_information_tool(company):
-    def load_knowledge_graph(filepath):
-        kg = {}
-        with open(filepath, 'r') as file:
-            for line in file:
-                entity1, relation, entity2 = line.strip().strip('()').split(', ')
-                if entity1 not in kg:
-                    kg[entity1] = []
-                kg[entity1].append((relation, entity2))
-        return kg
-    
-    kg_filepath = 'final_kg.txt'
-    kg = load_knowledge_graph(kg_filepath)
-    all_relations = kg[KG_NODES_MAPPING[company]]
+    kg = get_knowledge_graph()
+    all_relations = kg.edges(KG_NODES_MAPPING[company])
     prompt = "We are talking about the company {company}. Here are the relations: {relations}. Please provide a summary of the company. Respond as a string".format(company=company, relations=all_relations)
-    result = query_gemini(prompt)
+    result = query_gemini(prompt, cache_site="company_background")
     return result
 
 def view_upstox_account_balance_tool(access_token=None):
@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Warmup:
+    """
+    Loads heavy resources one after another on a background thread while the server is already
+    accepting requests, and records each one's state (pending, loading, ready, failed) and load
+    duration for the health endpoints.
+    """
+
+    def __init__(self):
+        self.resources = OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, name, loader):
+        self.resources[name] = {"loader": loader, "state": "pending", "seconds": None, "error": None}
+
+    def _load(self, name):
+        resource = self.resources[name]
+        with self.lock:
+            resource["state"] = "loading"
+        start = time.perf_counter()
+        try:
+            resource["loader"]()
+        except Exception as e:
+            print(f"Error loading {name}: {e}")
+            state, error = "failed", str(e)
+        else:
+            state, error = "ready", None
+        with self.lock:
+            resource.update(state=state, seconds=round(time.perf_counter() - start, 3), error=error)
+
+    def _run(self):
+        for name in self.resources:
+            self._load(name)
+
+    def start(self):
+        """Starts loading in a daemon thread, returns immediately."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self.thread.start()
+        return self
+
+    def status(self):
+        with self.lock:
+            return {
+                name: {key: value for key, value in resource.items() if key != "loader"}
+                for name, resource in self.resources.items()
+            }
+
+    def is_ready(self, names=None):
+        with self.lock:
+            return all(self.resources[name]["state"] == "ready" for name in (names or self.resources))
@@ -437,9 +437,9 @@ function handleParsedMessage(msg: any) {
     setInterfaceState("RESULT");
     addChatMessage({ type: "result", content: msg });
   } else if (msg.message) {
-    // Process progress update
+    // Process progress update; stages finish out of order, so progress comes from completed_stages
     const stageInfo = {
-      stage: msg.stage || 1,
+      stage: msg.completed_stages || msg.stage || 1,
       total: msg.total_stages || 9,
       message: msg.message
     };